@@ -0,0 +1,200 @@
+# The MIT License (MIT)
+# Copyright (c) 2022 Mike Teachman
+# https://opensource.org/licenses/MIT
+
+# Purpose:  Board detection and SD card handling shared by the examples
+#
+# Each example used to carry its own copy of the ~40 line platform
+# dispatch.  This module runs the detection once, at first import, and
+# gives the SD card tuning (SDMMC frequency, SPI baudrate, RP2040 system
+# clock) a single home.  Examples with no SD card only use the pin
+# assignments and never call mount_sd().
+#
+# usage:
+#     import board_config
+#
+#     board_config.mount_sd()
+#     audio_out = I2S(
+#         board_config.TX_I2S_ID,
+#         sck=Pin(board_config.TX_SCK_PIN),
+#         ...
+#     )
+#     ...
+#     board_config.umount_sd()
+
+import os
+from machine import Pin
+
+# cache the machine name:  os.uname() allocates a tuple and a string
+# on every call, which matters in cleanup paths that run in callbacks
+MACHINE = os.uname().machine
+
+# I2S peripheral and pin assignments.  TX_* is the playback interface
+# (amplifier or DAC module), RX_* the recording interface (microphone).
+# The two sets differ only on the Teensy 4.1, which wires playback and
+# recording to two different I2S peripherals
+if "PYBv1" in MACHINE:
+    PLATFORM = "PYBv1"
+
+    # ======= I2S CONFIGURATION =======
+    TX_SCK_PIN = RX_SCK_PIN = "Y6"
+    TX_WS_PIN = RX_WS_PIN = "Y5"
+    TX_SD_PIN = RX_SD_PIN = "Y8"
+    TX_I2S_ID = RX_I2S_ID = 2
+    # ======= I2S CONFIGURATION =======
+
+elif "PYBD" in MACHINE:
+    PLATFORM = "PYBD"
+
+    # ======= I2S CONFIGURATION =======
+    TX_SCK_PIN = RX_SCK_PIN = "Y6"
+    TX_WS_PIN = RX_WS_PIN = "Y5"
+    TX_SD_PIN = RX_SD_PIN = "Y8"
+    TX_I2S_ID = RX_I2S_ID = 2
+    # ======= I2S CONFIGURATION =======
+
+elif "ESP32" in MACHINE:
+    PLATFORM = "ESP32"
+
+    # ======= I2S CONFIGURATION =======
+    TX_SCK_PIN = RX_SCK_PIN = 32
+    TX_WS_PIN = RX_WS_PIN = 25
+    TX_SD_PIN = RX_SD_PIN = 33
+    TX_I2S_ID = RX_I2S_ID = 0
+    # ======= I2S CONFIGURATION =======
+
+elif "Raspberry" in MACHINE:
+    PLATFORM = "Raspberry"
+
+    # ======= I2S CONFIGURATION =======
+    TX_SCK_PIN = RX_SCK_PIN = 16
+    TX_WS_PIN = RX_WS_PIN = 17
+    TX_SD_PIN = RX_SD_PIN = 18
+    TX_I2S_ID = RX_I2S_ID = 0
+    # ======= I2S CONFIGURATION =======
+
+elif "MIMXRT" in MACHINE:
+    PLATFORM = "MIMXRT"
+
+    # ======= I2S CONFIGURATION =======
+    TX_SCK_PIN = 4
+    TX_WS_PIN = 3
+    TX_SD_PIN = 2
+    TX_I2S_ID = 2
+    RX_SCK_PIN = 21
+    RX_WS_PIN = 20
+    RX_SD_PIN = 8
+    RX_I2S_ID = 1
+    # ======= I2S CONFIGURATION =======
+
+else:
+    PLATFORM = "UNKNOWN"
+    print("Warning: program not tested with this board")
+
+# the SD card interface objects, created by mount_sd() and released by
+# umount_sd()
+_sd = None
+_spi = None
+
+
+def mount_sd():
+    # mount the SD card at /sd using the fastest transfer mode the board
+    # supports.  On the PYBv1 the card is mounted by the boot process, so
+    # there is nothing to do
+    global _sd, _spi
+    if PLATFORM == "PYBD":
+        import pyb
+
+        pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
+        os.mount(pyb.SDCard(), "/sd")
+    elif PLATFORM == "ESP32":
+        from machine import SDCard
+
+        # prefer the hardware 4-bit SD/MMC interface:  many times the
+        # throughput of the SPI slot, which can fall behind high-bitrate WAV
+        # files.  Fall back to the SPI slot on boards where the SDMMC pins
+        # are not wired to the card socket
+        try:
+            _sd = SDCard(slot=1, width=4, freq=40_000_000)  # clk=14, cmd=15, d0-d3=2,4,12,13
+            os.mount(_sd, "/sd")
+        except OSError:
+            try:
+                # 4-bit mode needs the DAT1-DAT3 lines wired and pulled up;
+                # 1-bit SD/MMC still beats the SPI slot by a wide margin
+                _sd = SDCard()
+                os.mount(_sd, "/sd")
+            except OSError:
+                _sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
+                os.mount(_sd, "/sd")
+    elif PLATFORM == "Raspberry":
+        import machine
+
+        # raise the system clock before touching the SD card:  SPI and the
+        # software SD driver loops are clocked from it, so 250 MHz lets the
+        # SPI bus sustain the full 25 MHz baudrate
+        try:
+            machine.freq(250_000_000)
+        except ValueError:
+            pass  # port rejected the frequency:  stay at the default
+        # prefer the native SD/MMC controller where the port provides one:
+        # 4-bit SDIO offers roughly 10x the throughput of the SPI mode driver.
+        # note:  reliable 4-bit operation requires 10k pull-up resistors on the
+        # CMD and DAT lines
+        try:
+            from machine import SDCard
+
+            _sd = SDCard()
+            os.mount(_sd, "/sd")
+        except ImportError:
+            # this port has no SD/MMC controller:  fall back to the SPI mode driver
+            from sdcard import SDCard
+            from machine import SPI
+
+            cs = Pin(13, machine.Pin.OUT)
+            _spi = SPI(
+                1,
+                baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
+                polarity=0,
+                phase=0,
+                bits=8,
+                firstbit=machine.SPI.MSB,
+                sck=Pin(14),
+                mosi=Pin(15),
+                miso=Pin(12),
+            )
+
+            # pass the target baudrate to the driver:  card enumeration still runs
+            # at the slow clock the SD spec requires, then the driver upshifts
+            # itself.  A separate init_spi() call after construction left
+            # hundreds of init transactions running at the default baudrate.
+            # Probe 40 MHz first - mounting reads the filesystem, so a card or
+            # wiring that cannot sustain the clock fails here - and fall back
+            # to the 25 MHz rate the SD spec guarantees
+            try:
+                _sd = SDCard(_spi, cs, baudrate=40_000_000)
+                os.mount(_sd, "/sd")
+            except OSError:
+                _sd = SDCard(_spi, cs, baudrate=25_000_000)
+                os.mount(_sd, "/sd")
+    elif PLATFORM == "MIMXRT":
+        from machine import SDCard
+
+        _sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
+        os.mount(_sd, "/sd")
+
+
+def umount_sd():
+    # undo mount_sd():  unmount the filesystem and release the card interface
+    global _sd, _spi
+    if PLATFORM == "PYBD":
+        os.umount("/sd")
+    elif PLATFORM in ("ESP32", "MIMXRT"):
+        os.umount("/sd")
+        _sd.deinit()
+        _sd = None
+    elif PLATFORM == "Raspberry":
+        os.umount("/sd")
+        if _spi:  # SPI mode driver in use:  release the bus
+            _spi.deinit()
+            _spi = None
+        _sd = None
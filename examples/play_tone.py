@@ -11,99 +11,62 @@
 # Blocking version
 # - the write() method blocks until the entire sample buffer is written to I2S
 
-import os
 import math
 import struct
 from machine import I2S
 from machine import Pin
 
-def make_tone(rate, bits, frequency):
+import board_config
+
+def make_tone(rate, bits, frequency, channels):
     # create a buffer containing the pure tone samples
     samples_per_cycle = rate // frequency
-    sample_size_in_bytes = bits // 8
-    samples = bytearray(samples_per_cycle * sample_size_in_bytes)
     volume_reduction_factor = 32
-    range = pow(2, bits) // 2 // volume_reduction_factor
-    
+    amplitude = pow(2, bits) // 2 // volume_reduction_factor
+
     if bits == 16:
-        format = "<h"
+        format = "<{}h".format(samples_per_cycle * channels)
     else:  # assume 32 bits
-        format = "<l"
-    
-    for i in range(samples_per_cycle):
-        sample = range + int((range - 1) * math.sin(2 * math.pi * i / samples_per_cycle))
-        struct.pack_into(format, samples, i * sample_size_in_bytes, sample)
-        
-    return samples
-
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 2000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 2000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 2000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 2000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 4
-    WS_PIN = 3
-    SD_PIN = 2
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 2000
-    # ======= I2S CONFIGURATION =======
-
-else:
-    print("Warning: program not tested with this board")
+        format = "<{}l".format(samples_per_cycle * channels)
+
+    # compute the sample values, then pack the entire cycle with a single
+    # struct.pack() call.  One bulk pack runs in C code, replacing
+    # samples_per_cycle interpreted pack_into() calls
+    sin = math.sin
+    two_pi = 2 * math.pi
+    values = [
+        amplitude + int((amplitude - 1) * sin(two_pi * i / samples_per_cycle))
+        for i in range(samples_per_cycle)
+    ]
+    if channels == 2:
+        # interleave each sample into the left and right channels:
+        # duplicating the samples here, once, is cheaper than having the I2S
+        # driver expand mono to stereo on every write
+        values = [v for v in values for _ in range(2)]
+    return struct.pack(format, *values)
+
+# board detection and I2S pin assignments are shared by all examples:
+# see board_config.py.  No SD card is used by this example
+BUFFER_LENGTH_IN_BYTES = 2000
 
 # ======= AUDIO CONFIGURATION =======
 TONE_FREQUENCY_IN_HZ = 440
 SAMPLE_SIZE_IN_BITS = 16
-FORMAT = I2S.MONO  # only MONO supported in this example
+FORMAT = I2S.STEREO  # many I2S DACs (e.g. PCM5102) are stereo-only
 SAMPLE_RATE_IN_HZ = 22_050
+NUM_CHANNELS = 2 if FORMAT == I2S.STEREO else 1
 # ======= AUDIO CONFIGURATION =======
 
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(board_config.TX_SCK_PIN)
+ws_pin = Pin(board_config.TX_WS_PIN)
+sd_pin = Pin(board_config.TX_SD_PIN)
+
 audio_out = I2S(
-    I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    board_config.TX_I2S_ID,
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.TX,
     bits=SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -111,7 +74,16 @@ audio_out = I2S(
     ibuf=BUFFER_LENGTH_IN_BYTES,
 )
 
-samples = make_tone(SAMPLE_RATE_IN_HZ, SAMPLE_SIZE_IN_BITS, TONE_FREQUENCY_IN_HZ)
+one_cycle = make_tone(SAMPLE_RATE_IN_HZ, SAMPLE_SIZE_IN_BITS, TONE_FREQUENCY_IN_HZ, NUM_CHANNELS)
+
+# replicate the single cycle so each write() call submits a large buffer
+# holding a whole number of cycles:  fewer write() calls are needed each
+# second and the buffer wraps around on a cycle boundary, with no
+# phase discontinuity
+num_cycles = max(1, BUFFER_LENGTH_IN_BYTES // len(one_cycle))
+samples = bytearray(num_cycles * len(one_cycle))
+for i in range(num_cycles):
+    samples[i * len(one_cycle) : (i + 1) * len(one_cycle)] = one_cycle
 
 # continuously write tone sample buffer to an I2S DAC
 print("==========  START PLAYBACK ==========")
@@ -120,7 +92,7 @@ try:
         num_written = audio_out.write(samples)
 
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
 audio_out.deinit()
@@ -16,65 +16,16 @@
 # to internal flash memory. The Thonny IDE also offers an easy way to copy this file (View->Files, `Upload to /` option).
 
 
+import gc
 import os
 from machine import I2S
 from machine import Pin
 
-if os.uname().machine.count("PYBv1"):
+import board_config
 
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 5000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 5000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 5000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 5000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 4
-    WS_PIN = 3
-    SD_PIN = 2
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 5000
-    # ======= I2S CONFIGURATION =======
-
-else:
-    print("Warning: program not tested with this board")
+# board detection and I2S pin assignments are shared by all examples:
+# see board_config.py.  No SD card is used by this example
+BUFFER_LENGTH_IN_BYTES = 5000
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "side-to-side-8k-16bits-stereo.wav"
@@ -83,11 +34,16 @@ FORMAT = I2S.STEREO
 SAMPLE_RATE_IN_HZ = 8000
 # ======= AUDIO CONFIGURATION =======
 
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(board_config.TX_SCK_PIN)
+ws_pin = Pin(board_config.TX_WS_PIN)
+sd_pin = Pin(board_config.TX_SD_PIN)
+
 audio_out = I2S(
-    I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    board_config.TX_I2S_ID,
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.TX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -98,28 +54,45 @@ audio_out = I2S(
 wav = open(WAV_FILE, "rb")
 pos = wav.seek(44)  # advance to first byte of Data section in WAV file
 
-# allocate sample array
-# memoryview used to reduce heap allocation
-wav_samples = bytearray(1000)
-wav_samples_mv = memoryview(wav_samples)
+# when the Data section fits comfortably in RAM, read it once and loop
+# playback out of RAM:  every filesystem read of a flash file costs VFS
+# overhead and XIP cache misses, none of which is needed a second time
+data_size = os.stat(WAV_FILE)[6] - 44
+preloaded = data_size < gc.mem_free() // 2
+
+if preloaded:
+    wav_samples_mv = memoryview(wav.read())
+    wav.close()
+else:
+    # WAV file is too large to preload:  stream it from flash
+    # allocate sample array
+    # memoryview used to reduce heap allocation
+    # sized to a multiple of the flash sector size and the I2S sample frame
+    wav_samples = bytearray(1024)
+    wav_samples_mv = memoryview(wav_samples)
 
 # continuously read audio samples from the WAV file
 # and write them to an I2S DAC
 print("==========  START PLAYBACK ==========")
 try:
-    while True:
-        num_read = wav.readinto(wav_samples_mv)
-        # end of WAV file?
-        if num_read == 0:
-            # end-of-file, advance to first byte of Data section
-            _ = wav.seek(44)
-        else:
-            _ = audio_out.write(wav_samples_mv[:num_read])
+    if preloaded:
+        while True:
+            _ = audio_out.write(wav_samples_mv)
+    else:
+        while True:
+            num_read = wav.readinto(wav_samples_mv)
+            # end of WAV file?
+            if num_read == 0:
+                # end-of-file, advance to first byte of Data section
+                _ = wav.seek(44)
+            else:
+                _ = audio_out.write(wav_samples_mv[:num_read])
 
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
-wav.close()
+if not preloaded:
+    wav.close()
 audio_out.deinit()
 print("Done")
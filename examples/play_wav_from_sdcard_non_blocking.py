@@ -14,95 +14,37 @@
 # - a callback function is called when all sample data has been written to the I2S interface
 # - a callback() method sets the callback function
 
-import os
+import struct
 import time
 import micropython
+from micropython import const
 from machine import I2S
 from machine import Pin
 
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-    os.mount(pyb.SDCard(), "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-    from machine import SDCard
-
-    sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-    from sdcard import SDCard
-    from machine import SPI
-
-    cs = Pin(13, machine.Pin.OUT)
-    spi = SPI(
-        1,
-        baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
-        polarity=0,
-        phase=0,
-        bits=8,
-        firstbit=machine.SPI.MSB,
-        sck=Pin(14),
-        mosi=Pin(15),
-        miso=Pin(12),
-    )
-
-    sd = SDCard(spi, cs)
-    sd.init_spi(25_000_000)  # increase SPI bus speed to SD card
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-    from machine import SDCard
-
-    sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 4
-    WS_PIN = 3
-    SD_PIN = 2
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-else:
-    print("Warning: program not tested with this board")
+import board_config
+
+
+def parse_wav_header(wav_file):
+    # parse the WAV file header and return the offset and length of the Data
+    # section.  Walking the RIFF chunks is more robust than the often-seen
+    # seek(44):  WAV files written by many audio tools contain extra chunks
+    # (e.g. LIST/INFO) ahead of the Data chunk
+    chunk_id, _, format = struct.unpack("<4sI4s", wav_file.read(12))
+    if chunk_id != b"RIFF" or format != b"WAVE":
+        raise ValueError("invalid WAV file")
+    while True:
+        header = wav_file.read(8)
+        if len(header) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return wav_file.tell(), chunk_size
+        _ = wav_file.seek(chunk_size, 1)  # skip over this chunk
+
+
+# board detection, I2S pin assignments and SD card setup are shared by
+# all examples:  see board_config.py
+board_config.mount_sd()
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "music-16k-16bits-mono.wav"
@@ -111,60 +53,108 @@ FORMAT = I2S.MONO
 SAMPLE_RATE_IN_HZ = 16000
 # ======= AUDIO CONFIGURATION =======
 
-PLAY = 0
-PAUSE = 1
-RESUME = 2
-STOP = 3
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough audio to ride out SD card latency spikes and GC pauses,
+# rounded up to a whole number of 512 byte SD card sectors.  A fixed 40000
+# bytes was 625 ms of audio at 16 kHz mono - wasted RAM on small boards
+TARGET_LATENCY_IN_MS = 150
+FRAME_SIZE_IN_BYTES = (WAV_SAMPLE_SIZE_IN_BITS // 8) * (2 if FORMAT == I2S.STEREO else 1)
+BUFFER_LENGTH_IN_BYTES = max(
+    512, (SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 511) & ~511
+)
 
+# const() folds the state values into the bytecode, so each test in
+# the callback is a small-int compare instead of a module-dict lookup
+PLAY = const(0)
+PAUSE = const(1)
+RESUME = const(2)
+STOP = const(3)
+
+
+def refill(idx):
+    # read the next block of samples from the WAV file into buffer 'idx'.
+    # refill() runs in the micropython.schedule() context, outside of the
+    # I2S interrupt, so a slow SD card read cannot stall the audio stream.
+    # Reads never cross the end of the Data section:  trailing chunks
+    # (if any) must not be played as audio samples
+    global num_filled
+    global eof_count
+    to_read = min(len(wav_samples[idx]), data_end - wav.tell())
+    # end of WAV file?
+    if to_read == 0:
+        # end-of-file, advance to first byte of Data section.  Note the
+        # wrap with a bare counter increment:  printing here would
+        # allocate, and the main thread reports the wrap instead
+        _ = wav.seek(data_offset)
+        eof_count += 1
+        # state = STOP  # uncomment to stop looping playback
+        to_read = min(len(wav_samples[idx]), data_end - wav.tell())
+    if to_read == len(wav_samples[idx]):
+        num_read = wav.readinto(wav_samples_mv[idx])
+    else:
+        num_read = wav.readinto(wav_samples_mv[idx][:to_read])
+    num_filled[idx] = num_read
 
-def eof_callback(arg):
-    global state
-    print("end of audio file")
-    # state = STOP  # uncomment to stop looping playback
 
+def sleep_and_report_eof(seconds):
+    # wait in the main thread, printing a message each time the playback
+    # loop wraps past the end of the WAV file
+    global eof_printed
+    for _ in range(seconds * 50):
+        time.sleep_ms(20)
+        if eof_printed != eof_count:
+            eof_printed = eof_count
+            print("end of audio file")
 
+
+@micropython.native
 def i2s_callback(arg):
     global state
+    global next_to_play
+    global stopped
     if state == PLAY:
-        num_read = wav.readinto(wav_samples_mv)
-        # end of WAV file?
-        if num_read == 0:
-            # end-of-file, advance to first byte of Data section
-            pos = wav.seek(44)
-            _ = audio_out.write(silence)
-            micropython.schedule(eof_callback, None)
+        # ping-pong the two sample buffers:  write the buffer that
+        # refill() has filled, then schedule a refill of the buffer that
+        # was consumed by the previous write
+        idx = next_to_play
+        next_to_play = idx ^ 1
+        if num_filled[idx] > 0:
+            _ = audio_out.write(wav_samples_mv[idx][: num_filled[idx]])
         else:
-            _ = audio_out.write(wav_samples_mv[:num_read])
+            _ = audio_out.write(silence)
+        micropython.schedule(refill, next_to_play)
     elif state == RESUME:
         state = PLAY
         _ = audio_out.write(silence)
     elif state == PAUSE:
         _ = audio_out.write(silence)
     elif state == STOP:
-        # cleanup
-        wav.close()
-        if os.uname().machine.count("PYBD"):
-            os.umount("/sd")
-        elif os.uname().machine.count("ESP32"):
-            os.umount("/sd")
-            sd.deinit()
-        elif os.uname().machine.count("Raspberry"):
-            os.umount("/sd")
-            spi.deinit()
-        elif os.uname().machine.count("MIMXRT"):
-            os.umount("/sd")
-            sd.deinit()
-        audio_out.deinit()
-        print("Done")
+        # signal the main thread:  cleanup has platform-conditional work,
+        # string scans and file I/O, none of which belongs in an
+        # interrupt context
+        stopped = True
     else:
         print("Not a valid state.  State ignored")
 
 
+def cleanup():
+    # runs in the main thread after the callback has signalled STOP
+    wav.close()
+    board_config.umount_sd()
+    audio_out.deinit()
+    print("Done")
+
+
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(board_config.TX_SCK_PIN)
+ws_pin = Pin(board_config.TX_WS_PIN)
+sd_pin = Pin(board_config.TX_SD_PIN)
+
 audio_out = I2S(
-    I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    board_config.TX_I2S_ID,
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.TX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -172,32 +162,66 @@ audio_out = I2S(
     ibuf=BUFFER_LENGTH_IN_BYTES,
 )
 
+wav = open("/sd/" + WAV_FILE, "rb")
+# locate the Data section once, then cache the offset and end position
+data_offset, data_len = parse_wav_header(wav)
+data_end = data_offset + data_len
+
+# blank samples written while playback is paused.  Immutable bytes, the
+# same size as the sample buffers:  an undersized silence buffer makes the
+# callback fire back-to-back many times per DMA cycle just to keep the
+# stream fed during PAUSE
+silence = bytes(10240)
+
+# allocate two sample buffers:  one is being written to the I2S interface
+# while the other is being refilled from the SD card
+# sized to a multiple of the 512 byte SD card sector and the I2S sample frame
+wav_samples = [bytearray(10240), bytearray(10240)]
+wav_samples_mv = [memoryview(b) for b in wav_samples]
+num_filled = [0, 0]
+
+# pre-fill the I2S internal buffer with real audio before the callback is
+# attached:  write() blocks until irq() is set.  This guarantees the DMA
+# starts out full of audio samples, so a slow first SD card read after the
+# callback chain starts cannot cause an audible underrun
+for _ in range(max(1, BUFFER_LENGTH_IN_BYTES // len(wav_samples[0]))):
+    to_read = min(len(wav_samples[0]), data_end - wav.tell())
+    if to_read == 0:
+        _ = wav.seek(data_offset)
+        to_read = min(len(wav_samples[0]), data_end - wav.tell())
+    num_read = wav.readinto(wav_samples_mv[0][:to_read])
+    _ = audio_out.write(wav_samples_mv[0][:num_read])
+
+# fill both sample buffers so the callback chain starts with audio ready
+eof_count = 0
+eof_printed = 0
+refill(0)
+refill(1)
+next_to_play = 1
+
+stopped = False
+state = PLAY
 audio_out.irq(i2s_callback)
-state = PAUSE
-
-wav = open("/sd/{}".format(WAV_FILE), "rb")
-_ = wav.seek(44)  # advance to first byte of Data section in WAV file
-
-# allocate a small array of blank samples
-silence = bytearray(1000)
-
-# allocate sample array buffer
-wav_samples = bytearray(10000)
-wav_samples_mv = memoryview(wav_samples)
 
-_ = audio_out.write(silence)
+# kick off the callback chain with a non-blocking write of the first buffer
+_ = audio_out.write(wav_samples_mv[0][: num_filled[0]])
 
 # add runtime code here ....
 # changing 'state' will affect playback of audio file
 
 print("starting playback for 10s")
 state = PLAY
-time.sleep(10)
+sleep_and_report_eof(10)
 print("pausing playback for 10s")
 state = PAUSE
-time.sleep(10)
+sleep_and_report_eof(10)
 print("resuming playback for 15s")
 state = RESUME
-time.sleep(15)
+sleep_and_report_eof(15)
 print("stopping playback")
 state = STOP
+# wait for the callback to acknowledge the stop, then clean up here in
+# the main thread
+while not stopped:
+    time.sleep_ms(20)
+cleanup()
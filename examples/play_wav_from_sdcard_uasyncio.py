@@ -11,96 +11,36 @@
 #
 # uasyncio version
 
-import os
-import time
+import struct
 import urandom
 import uasyncio as asyncio
 from machine import I2S
 from machine import Pin
 
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-    os.mount(pyb.SDCard(), "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-    from machine import SDCard
-
-    sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-    from sdcard import SDCard
-    from machine import SPI
-
-    cs = Pin(13, machine.Pin.OUT)
-    spi = SPI(
-        1,
-        baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
-        polarity=0,
-        phase=0,
-        bits=8,
-        firstbit=machine.SPI.MSB,
-        sck=Pin(14),
-        mosi=Pin(15),
-        miso=Pin(12),
-    )
-
-    sd = SDCard(spi, cs)
-    sd.init_spi(25_000_000)  # increase SPI bus speed to SD card
-    os.mount(sd, "/sd")
+import board_config
 
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
 
-elif os.uname().machine.count("MIMXRT"):
-    from machine import SDCard
-
-    sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
-    os.mount(sd, "/sd")
+def parse_wav_header(wav_file):
+    # parse the WAV file header and return the offset and length of the Data
+    # section.  Walking the RIFF chunks is more robust than the often-seen
+    # seek(44):  WAV files written by many audio tools contain extra chunks
+    # (e.g. LIST/INFO) ahead of the Data chunk
+    chunk_id, _, format = struct.unpack("<4sI4s", wav_file.read(12))
+    if chunk_id != b"RIFF" or format != b"WAVE":
+        raise ValueError("invalid WAV file")
+    while True:
+        header = wav_file.read(8)
+        if len(header) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return wav_file.tell(), chunk_size
+        _ = wav_file.seek(chunk_size, 1)  # skip over this chunk
 
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 4
-    WS_PIN = 3
-    SD_PIN = 2
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
 
-else:
-    print("Warning: program not tested with this board")
+# board detection, I2S pin assignments and SD card setup are shared by
+# all examples:  see board_config.py
+board_config.mount_sd()
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "music-16k-16bits-stereo.wav"
@@ -109,15 +49,28 @@ FORMAT = I2S.STEREO
 SAMPLE_RATE_IN_HZ = 16000
 # ======= AUDIO CONFIGURATION =======
 
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough audio to ride out SD card latency spikes and GC pauses,
+# rounded up to a whole number of 512 byte SD card sectors.  A fixed 40000
+# bytes was 625 ms of audio at 16 kHz mono - wasted RAM on small boards
+TARGET_LATENCY_IN_MS = 150
+FRAME_SIZE_IN_BYTES = (WAV_SAMPLE_SIZE_IN_BITS // 8) * (2 if FORMAT == I2S.STEREO else 1)
+BUFFER_LENGTH_IN_BYTES = max(
+    512, (SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 511) & ~511
+)
+
 
 async def continuous_play(audio_out, wav):
     swriter = asyncio.StreamWriter(audio_out)
 
-    _ = wav.seek(44)  # advance to first byte of Data section in WAV file
+    # locate the Data section once, then cache the offset and end position
+    data_offset, data_len = parse_wav_header(wav)
+    data_end = data_offset + data_len
 
     # allocate sample array
     # memoryview used to reduce heap allocation
-    wav_samples = bytearray(10000)
+    # sized to a multiple of the 512 byte SD card sector and the I2S sample frame
+    wav_samples = bytearray(10240)
     wav_samples_mv = memoryview(wav_samples)
 
     # continuously read audio samples from the WAV file
@@ -125,17 +78,28 @@ async def continuous_play(audio_out, wav):
     print("==========  START PLAYBACK ==========")
 
     while True:
-        num_read = wav.readinto(wav_samples_mv)
+        # never read past the end of the Data section:  trailing chunks
+        # (if any) must not be played as audio samples
+        to_read = min(len(wav_samples), data_end - wav.tell())
         # end of WAV file?
-        if num_read == 0:
+        if to_read == 0:
             # end-of-file, advance to first byte of Data section
-            _ = wav.seek(44)
+            _ = wav.seek(data_offset)
         else:
+            num_read = wav.readinto(wav_samples_mv[:to_read])
+            # always write the full buffer:  slicing the memoryview on every
+            # iteration allocates a small object on the heap each time, making
+            # the audio loop a steady source of GC work.  When the end of the
+            # WAV file leaves the buffer partly filled, zero the tail so the
+            # unfilled portion plays as silence
+            if num_read < len(wav_samples):
+                for i in range(num_read, len(wav_samples)):
+                    wav_samples[i] = 0
             # apply temporary workaround to eliminate heap allocation in uasyncio Stream class.
             # workaround can be removed after acceptance of PR:
             #    https://github.com/micropython/micropython/pull/7868
-            # swriter.write(wav_samples_mv[:num_read])
-            swriter.out_buf = wav_samples_mv[:num_read]
+            # swriter.write(wav_samples_mv)
+            swriter.out_buf = wav_samples_mv
             await swriter.drain()
 
 
@@ -143,7 +107,10 @@ async def another_task(name):
     while True:
         await asyncio.sleep(urandom.randrange(2, 5))
         print("{} woke up".format(name))
-        time.sleep_ms(1)  # simulates task doing something
+        # simulates task doing something.  Note:  a coroutine must never use
+        # the blocking time.sleep_ms() - it stalls the scheduler and starves
+        # the audio stream
+        await asyncio.sleep_ms(1)
 
 
 async def main(audio_out, wav):
@@ -151,17 +118,21 @@ async def main(audio_out, wav):
     task_a = asyncio.create_task(another_task("task a"))
     task_b = asyncio.create_task(another_task("task b"))
 
-    # keep the event loop active
-    while True:
-        await asyncio.sleep_ms(10)
+    # the event loop runs for as long as the tasks are active
+    await asyncio.gather(play, task_a, task_b)
 
 
 try:
+    # create the pin objects once, ahead of the constructor call
+    sck_pin = Pin(board_config.TX_SCK_PIN)
+    ws_pin = Pin(board_config.TX_WS_PIN)
+    sd_pin = Pin(board_config.TX_SD_PIN)
+
     audio_out = I2S(
-        I2S_ID,
-        sck=Pin(SCK_PIN),
-        ws=Pin(WS_PIN),
-        sd=Pin(SD_PIN),
+        board_config.TX_I2S_ID,
+        sck=sck_pin,
+        ws=ws_pin,
+        sd=sd_pin,
         mode=I2S.TX,
         bits=WAV_SAMPLE_SIZE_IN_BITS,
         format=FORMAT,
@@ -169,24 +140,14 @@ try:
         ibuf=BUFFER_LENGTH_IN_BYTES,
     )
 
-    wav = open("/sd/{}".format(WAV_FILE), "rb")
+    wav = open("/sd/" + WAV_FILE, "rb")
     asyncio.run(main(audio_out, wav))
 except (KeyboardInterrupt, Exception) as e:
-    print("Exception {} {}\n".format(type(e).__name__, e))
+    print("Exception", type(e).__name__, e)
 finally:
     # cleanup
     wav.close()
-    if os.uname().machine.count("PYBD"):
-        os.umount("/sd")
-    elif os.uname().machine.count("ESP32"):
-        os.umount("/sd")
-        sd.deinit()
-    elif os.uname().machine.count("Raspberry"):
-        os.umount("/sd")
-        spi.deinit()
-    elif os.uname().machine.count("MIMXRT"):
-        os.umount("/sd")
-        sd.deinit()
+    board_config.umount_sd()
     audio_out.deinit()
     ret = asyncio.new_event_loop()  # Clear retained uasyncio state
     print("==========  DONE PLAYBACK ==========")
@@ -14,93 +14,15 @@
 # - the readinto() method blocks until
 #   the supplied buffer is filled
 
-import os
+import struct
 from machine import Pin
 from machine import I2S
 
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-    os.mount(pyb.SDCard(), "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-    from machine import SDCard
-
-    sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-    from sdcard import SDCard
-    from machine import SPI
-
-    cs = Pin(13, machine.Pin.OUT)
-    spi = SPI(
-        1,
-        baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
-        polarity=0,
-        phase=0,
-        bits=8,
-        firstbit=machine.SPI.MSB,
-        sck=Pin(14),
-        mosi=Pin(15),
-        miso=Pin(12),
-    )
-
-    sd = SDCard(spi, cs)
-    sd.init_spi(25_000_000)  # increase SPI bus speed to SD card
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 60000  # larger buffer to accommodate slow SD card driver
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-    from machine import SDCard
-
-    sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 21
-    WS_PIN = 20
-    SD_PIN = 8
-    I2S_ID = 1
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
+import board_config
 
-else:
-    print("Warning: program not tested with this board")
+# board detection, I2S pin assignments and SD card setup are shared by
+# all examples:  see board_config.py
+board_config.mount_sd()
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "mic.wav"
@@ -113,32 +35,53 @@ SAMPLE_RATE_IN_HZ = 22_050
 format_to_channels = {I2S.MONO: 1, I2S.STEREO: 2}
 NUM_CHANNELS = format_to_channels[FORMAT]
 WAV_SAMPLE_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BITS // 8
+
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough runway to ride out a worst-case SD card write stall
+# (cheap cards can freeze a write for hundreds of ms during internal flash
+# housekeeping), rounded up to a whole number of 4096 byte FAT clusters.
+# The software SPI SD driver on the RP2040 gets a larger budget still
+TARGET_LATENCY_IN_MS = 1500 if board_config.PLATFORM == "Raspberry" else 1000
+FRAME_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
+BUFFER_LENGTH_IN_BYTES = (
+    SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 4095
+) & ~4095
 RECORDING_SIZE_IN_BYTES = (
     RECORD_TIME_IN_SECONDS * SAMPLE_RATE_IN_HZ * WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
 )
 
 
 def create_wav_header(sampleRate, bitsPerSample, num_channels, num_samples):
-    datasize = num_samples * num_channels * bitsPerSample // 8
-    o = bytes("RIFF", "ascii")  # (4byte) Marks file as RIFF
-    o += (datasize + 36).to_bytes(
-        4, "little"
-    )  # (4byte) File size in bytes excluding this and RIFF marker
-    o += bytes("WAVE", "ascii")  # (4byte) File type
-    o += bytes("fmt ", "ascii")  # (4byte) Format Chunk Marker
-    o += (16).to_bytes(4, "little")  # (4byte) Length of above format data
-    o += (1).to_bytes(2, "little")  # (2byte) Format type (1 - PCM)
-    o += (num_channels).to_bytes(2, "little")  # (2byte)
-    o += (sampleRate).to_bytes(4, "little")  # (4byte)
-    o += (sampleRate * num_channels * bitsPerSample // 8).to_bytes(4, "little")  # (4byte)
-    o += (num_channels * bitsPerSample // 8).to_bytes(2, "little")  # (2byte)
-    o += (bitsPerSample).to_bytes(2, "little")  # (2byte)
-    o += bytes("data", "ascii")  # (4byte) Data Chunk Marker
-    o += (datasize).to_bytes(4, "little")  # (4byte) Data size in bytes
-    return o
-
-
-wav = open("/sd/{}".format(WAV_FILE), "wb")
+    # emit the complete 44 byte header with one struct.pack() call:  the
+    # repeated bytes concatenation it replaces made over 20 heap
+    # allocations to build one header
+    # the block align and byte rate fields are both derived from the same
+    # bytes-per-frame product:  compute it once and reuse it
+    block_align = num_channels * bitsPerSample // 8
+    byte_rate = sampleRate * block_align
+    datasize = num_samples * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",  # (4byte) Marks file as RIFF
+        datasize + 36,  # (4byte) File size in bytes excluding this and RIFF marker
+        b"WAVE",  # (4byte) File type
+        b"fmt ",  # (4byte) Format Chunk Marker
+        16,  # (4byte) Length of above format data
+        1,  # (2byte) Format type (1 - PCM)
+        num_channels,  # (2byte)
+        sampleRate,  # (4byte)
+        byte_rate,  # (4byte)
+        block_align,  # (2byte)
+        bitsPerSample,  # (2byte)
+        b"data",  # (4byte) Data Chunk Marker
+        datasize,  # (4byte) Data size in bytes
+    )
+
+
+# MicroPython VFS file objects write straight through to the FatFS
+# sector cache (there is no CPython-style file-object buffer to
+# bypass), so the staging buffer below is the only Python-side buffering
+wav = open("/sd/" + WAV_FILE, "wb")
 
 # create header for WAV file and write to SD card
 wav_header = create_wav_header(
@@ -149,11 +92,16 @@ wav_header = create_wav_header(
 )
 num_bytes_written = wav.write(wav_header)
 
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(board_config.RX_SCK_PIN)
+ws_pin = Pin(board_config.RX_WS_PIN)
+sd_pin = Pin(board_config.RX_SD_PIN)
+
 audio_in = I2S(
-    I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    board_config.RX_I2S_ID,
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.RX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -163,40 +111,52 @@ audio_in = I2S(
 
 # allocate sample arrays
 # memoryview used to reduce heap allocation in while loop
-mic_samples = bytearray(10000)
+# 8192 divides the FAT cluster and SD erase-block sizes, so each write
+# lands on filesystem boundaries instead of straddling them
+mic_samples = bytearray(8192)
 mic_samples_mv = memoryview(mic_samples)
 
-num_sample_bytes_written_to_wav = 0
+# staging buffer that batches several microphone buffers into one large SD
+# write:  FAT housekeeping (cluster allocation, directory updates) is paid
+# per write call, so one 32768 byte write sustains a much higher rate than
+# four 8192 byte writes
+write_buf = bytearray(32768)
+write_mv = memoryview(write_buf)
+write_off = 0
+
+num_sample_bytes_captured = 0
 
 print("Recording size: {} bytes".format(RECORDING_SIZE_IN_BYTES))
 print("==========  START RECORDING ==========")
 try:
-    while num_sample_bytes_written_to_wav < RECORDING_SIZE_IN_BYTES:
+    while num_sample_bytes_captured < RECORDING_SIZE_IN_BYTES:
         # read a block of samples from the I2S microphone
         num_bytes_read_from_mic = audio_in.readinto(mic_samples_mv)
         if num_bytes_read_from_mic > 0:
-            num_bytes_to_write = min(
-                num_bytes_read_from_mic, RECORDING_SIZE_IN_BYTES - num_sample_bytes_written_to_wav
+            num_bytes_to_stage = min(
+                num_bytes_read_from_mic, RECORDING_SIZE_IN_BYTES - num_sample_bytes_captured
             )
-            # write samples to WAV file
-            num_bytes_written = wav.write(mic_samples_mv[:num_bytes_to_write])
-            num_sample_bytes_written_to_wav += num_bytes_written
+            # copy the samples into the staging buffer
+            write_mv[write_off : write_off + num_bytes_to_stage] = mic_samples_mv[
+                :num_bytes_to_stage
+            ]
+            write_off += num_bytes_to_stage
+            num_sample_bytes_captured += num_bytes_to_stage
+            # flush to the SD card when another full microphone buffer
+            # would no longer fit
+            if write_off > len(write_buf) - len(mic_samples):
+                _ = wav.write(write_mv[:write_off])
+                write_off = 0
+
+    # flush any samples still staged when the recording time is reached
+    if write_off > 0:
+        _ = wav.write(write_mv[:write_off])
 
     print("==========  DONE RECORDING ==========")
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
 wav.close()
-if os.uname().machine.count("PYBD"):
-    os.umount("/sd")
-elif os.uname().machine.count("ESP32"):
-    os.umount("/sd")
-    sd.deinit()
-elif os.uname().machine.count("Raspberry"):
-    os.umount("/sd")
-    spi.deinit()
-elif os.uname().machine.count("MIMXRT"):
-    os.umount("/sd")
-    sd.deinit()
+board_config.umount_sd()
 audio_in.deinit()
@@ -14,94 +14,26 @@
 # - the readinto() method does not block.  A callback function
 #   is called when the buffer supplied to read_into() is filled
 
-import os
+import struct
 import time
+import micropython
+from micropython import const
 from machine import Pin
 from machine import I2S
 
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-    os.mount(pyb.SDCard(), "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-    from machine import SDCard
-
-    sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-    from sdcard import SDCard
-    from machine import SPI
-
-    cs = Pin(13, machine.Pin.OUT)
-    spi = SPI(
-        1,
-        baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
-        polarity=0,
-        phase=0,
-        bits=8,
-        firstbit=machine.SPI.MSB,
-        sck=Pin(14),
-        mosi=Pin(15),
-        miso=Pin(12),
-    )
-
-    sd = SDCard(spi, cs)
-    sd.init_spi(25_000_000)  # increase SPI bus speed to SD card
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 60000  # larger buffer to accommodate slow SD card driver
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-    from machine import SDCard
-
-    sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
-    os.mount(sd, "/sd")
+import board_config
 
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 21
-    WS_PIN = 20
-    SD_PIN = 8
-    I2S_ID = 1
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
+try:
+    # on dual-core ports (ESP32, RP2040) the SD write loop runs on the
+    # second core, dedicating this core to the I2S interrupt and the main
+    # program:  an SD card write stall can then never delay the microphone
+    import _thread
+except ImportError:
+    _thread = None
 
-else:
-    print("Warning: program not tested with this board")
+# board detection, I2S pin assignments and SD card setup are shared by
+# all examples:  see board_config.py
+board_config.mount_sd()
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "mic.wav"
@@ -110,93 +42,210 @@ FORMAT = I2S.MONO
 SAMPLE_RATE_IN_HZ = 22050
 # ======= AUDIO CONFIGURATION =======
 
-RECORD = 0
-PAUSE = 1
-RESUME = 2
-STOP = 3
+# const() folds the state values into the bytecode, so each test in
+# the callback is a small-int compare instead of a module-dict lookup
+RECORD = const(0)
+PAUSE = const(1)
+RESUME = const(2)
+STOP = const(3)
 
 format_to_channels = {I2S.MONO: 1, I2S.STEREO: 2}
 NUM_CHANNELS = format_to_channels[FORMAT]
 WAV_SAMPLE_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BITS // 8
 
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough runway to ride out a worst-case SD card write stall
+# (cheap cards can freeze a write for hundreds of ms during internal flash
+# housekeeping), rounded up to a whole number of 4096 byte FAT clusters.
+# The software SPI SD driver on the RP2040 gets a larger budget still
+TARGET_LATENCY_IN_MS = 1500 if board_config.PLATFORM == "Raspberry" else 1000
+FRAME_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
+BUFFER_LENGTH_IN_BYTES = (
+    SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 4095
+) & ~4095
+
 
 def create_wav_header(sampleRate, bitsPerSample, num_channels, num_samples):
-    datasize = num_samples * num_channels * bitsPerSample // 8
-    o = bytes("RIFF", "ascii")  # (4byte) Marks file as RIFF
-    o += (datasize + 36).to_bytes(
-        4, "little"
-    )  # (4byte) File size in bytes excluding this and RIFF marker
-    o += bytes("WAVE", "ascii")  # (4byte) File type
-    o += bytes("fmt ", "ascii")  # (4byte) Format Chunk Marker
-    o += (16).to_bytes(4, "little")  # (4byte) Length of above format data
-    o += (1).to_bytes(2, "little")  # (2byte) Format type (1 - PCM)
-    o += (num_channels).to_bytes(2, "little")  # (2byte)
-    o += (sampleRate).to_bytes(4, "little")  # (4byte)
-    o += (sampleRate * num_channels * bitsPerSample // 8).to_bytes(4, "little")  # (4byte)
-    o += (num_channels * bitsPerSample // 8).to_bytes(2, "little")  # (2byte)
-    o += (bitsPerSample).to_bytes(2, "little")  # (2byte)
-    o += bytes("data", "ascii")  # (4byte) Data Chunk Marker
-    o += (datasize).to_bytes(4, "little")  # (4byte) Data size in bytes
-    return o
-
-
-def i2s_callback_rx(arg):
-    global state
-    global num_sample_bytes_written_to_wav
-    global mic_samples_mv
-    global num_read
-
-    if state == RECORD:
-        num_bytes_written = wav.write(mic_samples_mv[:num_read])
-        num_sample_bytes_written_to_wav += num_bytes_written
-        # read samples from the I2S device.  This callback function
-        # will be called after 'mic_samples_mv' has been completely filled
-        # with audio samples
-        num_read = audio_in.readinto(mic_samples_mv)
-    elif state == RESUME:
-        state = RECORD
-        num_read = audio_in.readinto(mic_samples_mv)
-    elif state == PAUSE:
-        # in the PAUSE state read audio samples from the I2S device
-        # but do not write the samples to SD card
-        num_read = audio_in.readinto(mic_samples_mv)
-    elif state == STOP:
-        # create header for WAV file and write to SD card
-        wav_header = create_wav_header(
-            SAMPLE_RATE_IN_HZ,
-            WAV_SAMPLE_SIZE_IN_BITS,
-            NUM_CHANNELS,
-            num_sample_bytes_written_to_wav // (WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS),
-        )
-        _ = wav.seek(0)  # advance to first byte of Header section in WAV file
-        num_bytes_written = wav.write(wav_header)
-        # cleanup
+    # emit the complete 44 byte header with one struct.pack() call:  the
+    # repeated bytes concatenation it replaces made over 20 heap
+    # allocations to build one header
+    # the block align and byte rate fields are both derived from the same
+    # bytes-per-frame product:  compute it once and reuse it
+    block_align = num_channels * bitsPerSample // 8
+    byte_rate = sampleRate * block_align
+    datasize = num_samples * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",  # (4byte) Marks file as RIFF
+        datasize + 36,  # (4byte) File size in bytes excluding this and RIFF marker
+        b"WAVE",  # (4byte) File type
+        b"fmt ",  # (4byte) Format Chunk Marker
+        16,  # (4byte) Length of above format data
+        1,  # (2byte) Format type (1 - PCM)
+        num_channels,  # (2byte)
+        sampleRate,  # (4byte)
+        byte_rate,  # (4byte)
+        block_align,  # (2byte)
+        bitsPerSample,  # (2byte)
+        b"data",  # (4byte) Data Chunk Marker
+        datasize,  # (4byte) Data size in bytes
+    )
+
+
+# build the 44 byte header once at import:  the sample rate, bit depth and
+# channel count are fixed, so only the two size fields need to be patched
+# in once the actual number of recorded bytes is known
+WAV_HEADER = bytearray(
+    create_wav_header(SAMPLE_RATE_IN_HZ, WAV_SAMPLE_SIZE_IN_BITS, NUM_CHANNELS, 0)
+)
+
+
+def make_i2s_callbacks(wav, audio_in, mic_samples_mv):
+    # build the interrupt callback and its scheduled drain helper as
+    # closures:  the callback runs on every filled buffer, and closure
+    # cells are read with a simple array access (LOAD_DEREF) where module
+    # globals cost a dict lookup (LOAD_GLOBAL) per name per entry.
+    # mutable state lives in one-element lists so the main thread can
+    # change it through the returned 'state' cell
+    num_buffers = len(mic_samples_mv)
+    state = [PAUSE]
+    # head counts buffers filled from the microphone, tail counts buffers
+    # written to the WAV file.  The ring slot for a count is
+    # count % num_buffers
+    head = [0]
+    tail = [0]
+    num_sample_bytes_written_to_wav = [0]
+    stopped = [False]
+    done = [False]
+
+    def finalize():
+        # flush any buffers still pending in the ring (a no-op when the
+        # consumer thread drained it), then patch the two size fields in
+        # the header and release the SD card and I2S hardware.  The rest of
+        # the header was already written, correctly, when the file was
+        # opened, so two 4 byte writes replace a 44 byte header rewrite
+        drain(None)
+        datasize = num_sample_bytes_written_to_wav[0]
+        _ = wav.seek(4)
+        _ = wav.write((datasize + 36).to_bytes(4, "little"))
+        _ = wav.seek(40)
+        _ = wav.write(datasize.to_bytes(4, "little"))
         wav.close()
-        if os.uname().machine.count("PYBD"):
-            os.umount("/sd")
-        elif os.uname().machine.count("ESP32"):
-            os.umount("/sd")
-            sd.deinit()
-        elif os.uname().machine.count("Raspberry"):
-            os.umount("/sd")
-            spi.deinit()
-        elif os.uname().machine.count("MIMXRT"):
-            os.umount("/sd")
-            sd.deinit()
+        board_config.umount_sd()
         audio_in.deinit()
         print("Done")
-    else:
-        print("Not a valid state.  State ignored")
-
-
-wav = open("/sd/{}".format(WAV_FILE), "wb")
-pos = wav.seek(44)  # advance to first byte of Data section in WAV file
+        done[0] = True
+
+    def drain(arg):
+        # consumer side of the ring:  drain() runs in the micropython.schedule()
+        # context, outside of the I2S interrupt.  A slow SD card write (the
+        # card's flash housekeeping can stall a write for tens of ms) therefore
+        # cannot hold up the microphone sampling
+        while tail[0] != head[0]:
+            num_bytes_written = wav.write(mic_samples_mv[tail[0] % num_buffers])
+            num_sample_bytes_written_to_wav[0] += num_bytes_written
+            tail[0] += 1
+
+    def consumer():
+        # second-core version of drain():  the single-producer
+        # single-consumer ring with running head/tail counts needs no lock,
+        # because the callback only ever advances head and this thread only
+        # ever advances tail.  On STOP the thread writes any remaining
+        # buffers, patches the header and exits
+        while True:
+            if tail[0] != head[0]:
+                num_bytes_written = wav.write(mic_samples_mv[tail[0] % num_buffers])
+                num_sample_bytes_written_to_wav[0] += num_bytes_written
+                tail[0] += 1
+            elif stopped[0]:
+                finalize()
+                return
+            else:
+                time.sleep_ms(1)
+
+    @micropython.native
+    def i2s_callback_rx(arg):
+        # producer side of the ring:  runs in an interrupt context, so it must
+        # not allocate memory and must not block.  This callback function is
+        # called after a ring buffer has been completely filled with audio
+        # samples
+        s = state[0]
+        if s == RECORD:
+            h = head[0] + 1
+            if h - tail[0] >= num_buffers:
+                # ring overflow:  the SD card has fallen too far behind.
+                # re-read into the newest slot, overwriting the samples
+                # just captured
+                h -= 1
+            head[0] = h
+            _ = audio_in.readinto(mic_samples_mv[h % num_buffers])
+            if _thread is None:
+                # no second core:  drain the ring from the scheduler
+                # context, and only once at least two buffers are pending.
+                # Batching halves the schedule() traffic and hands the SD
+                # card larger sequential bursts, while the ring still
+                # absorbs a write stall.  (MicroPython SD drivers expose no
+                # card-busy poll, so deferring on pending depth is the
+                # closest available equivalent.)
+                if h - tail[0] >= 2:
+                    try:
+                        micropython.schedule(drain, None)
+                    except RuntimeError:
+                        pass  # drain is already scheduled
+        elif s == RESUME:
+            state[0] = RECORD
+            _ = audio_in.readinto(mic_samples_mv[head[0] % num_buffers])
+        elif s == PAUSE:
+            # in the PAUSE state read audio samples from the I2S device
+            # but do not write the samples to SD card
+            _ = audio_in.readinto(mic_samples_mv[head[0] % num_buffers])
+        elif s == STOP:
+            # only acknowledge the stop here:  file close, unmount and
+            # driver deinit are long-latency, allocation-heavy calls that
+            # must not run in the interrupt context.  The cleanup runs in
+            # wait_done() on the main thread, or in the consumer thread
+            # once it has flushed the remaining ring buffers
+            stopped[0] = True
+        else:
+            print("Not a valid state.  State ignored")
+
+    def wait_done():
+        # block until the interrupt callback has acknowledged STOP, then
+        # run the cleanup at main-thread scope.  With a consumer thread the
+        # cleanup belongs to that thread, so just wait for it to finish
+        while not stopped[0]:
+            time.sleep_ms(20)
+        if _thread is None:
+            finalize()
+        else:
+            while not done[0]:
+                time.sleep_ms(20)
+
+    if _thread:
+        _thread.start_new_thread(consumer, ())
+
+    return i2s_callback_rx, state, wait_done
+
+
+# MicroPython VFS file objects write straight through to the FatFS
+# sector cache:  there is no CPython-style file-object buffer, so no
+# buffering= argument is needed to avoid double-buffering
+wav = open("/sd/" + WAV_FILE, "wb")
+# write the header template to reserve its 44 bytes:  the constant fields
+# (sample rate, bit depth, channels) are already correct, leaving only the
+# two size fields to be patched when the recording stops
+num_bytes_written = wav.write(WAV_HEADER)
+
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(board_config.RX_SCK_PIN)
+ws_pin = Pin(board_config.RX_WS_PIN)
+sd_pin = Pin(board_config.RX_SD_PIN)
 
 audio_in = I2S(
-    I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    board_config.RX_I2S_ID,
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.RX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -204,34 +253,37 @@ audio_in = I2S(
     ibuf=BUFFER_LENGTH_IN_BYTES,
 )
 
+# allocate a ring of sample buffers
+# memoryview used to reduce heap allocation
+# 8192 divides the FAT cluster and SD erase-block sizes, so each write
+# lands on filesystem boundaries instead of straddling them
+NUM_BUFFERS = 4
+mic_samples = [bytearray(8192) for _ in range(NUM_BUFFERS)]
+mic_samples_mv = [memoryview(b) for b in mic_samples]
+
+i2s_callback_rx, state, wait_done = make_i2s_callbacks(wav, audio_in, mic_samples_mv)
+
 # setting a callback function makes the
 # readinto() method Non-Blocking
 audio_in.irq(i2s_callback_rx)
 
-# allocate sample arrays
-# memoryview used to reduce heap allocation in while loop
-mic_samples = bytearray(10000)
-mic_samples_mv = memoryview(mic_samples)
-
-num_sample_bytes_written_to_wav = 0
-
-state = PAUSE
 # start the background activity to read the microphone.
 # the callback will keep the activity continually running in the background.
-num_read = audio_in.readinto(mic_samples_mv)
+_ = audio_in.readinto(mic_samples_mv[0])
 
 # === Main program code goes here ===
 # audio sample recording to SD card will be running in the background
-# changing 'state' can cause the recording to Pause, Resume, or Stop
+# changing the 'state' cell can cause the recording to Pause, Resume, or Stop
 
 print("starting recording for 5s")
-state = RECORD
-time.sleep(5)
+state[0] = RECORD
+time.sleep_ms(5000)
 print("pausing recording for 2s")
-state = PAUSE
-time.sleep(2)
+state[0] = PAUSE
+time.sleep_ms(2000)
 print("resuming recording for 5s")
-state = RESUME
-time.sleep(5)
+state[0] = RESUME
+time.sleep_ms(5000)
 print("stopping recording and closing WAV file")
-state = STOP
+state[0] = STOP
+wait_done()
@@ -12,96 +12,17 @@
 #
 # uasyncio version
 
-import os
-import time
+import struct
 import urandom
 import uasyncio as asyncio
 from machine import I2S
 from machine import Pin
 
-if os.uname().machine.count("PYBv1"):
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("PYBD"):
-    import pyb
-
-    pyb.Pin("EN_3V3").on()  # provide 3.3V on 3V3 output pin
-    os.mount(pyb.SDCard(), "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = "Y6"
-    WS_PIN = "Y5"
-    SD_PIN = "Y8"
-    I2S_ID = 2
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("ESP32"):
-    from machine import SDCard
-
-    sd = SDCard(slot=2)  # sck=18, mosi=23, miso=19, cs=5
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 32
-    WS_PIN = 25
-    SD_PIN = 33
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("Raspberry"):
-    from sdcard import SDCard
-    from machine import SPI
-
-    cs = Pin(13, machine.Pin.OUT)
-    spi = SPI(
-        1,
-        baudrate=1_000_000,  # this has no effect on spi bus speed to SD Card
-        polarity=0,
-        phase=0,
-        bits=8,
-        firstbit=machine.SPI.MSB,
-        sck=Pin(14),
-        mosi=Pin(15),
-        miso=Pin(12),
-    )
-
-    sd = SDCard(spi, cs)
-    sd.init_spi(25_000_000)  # increase SPI bus speed to SD card
-    os.mount(sd, "/sd")
-
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 16
-    WS_PIN = 17
-    SD_PIN = 18
-    I2S_ID = 0
-    BUFFER_LENGTH_IN_BYTES = 60000  # larger buffer to accommodate slow SD card driver
-    # ======= I2S CONFIGURATION =======
-
-elif os.uname().machine.count("MIMXRT"):
-    from machine import SDCard
-
-    sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
-    os.mount(sd, "/sd")
+import board_config
 
-    # ======= I2S CONFIGURATION =======
-    SCK_PIN = 21
-    WS_PIN = 20
-    SD_PIN = 8
-    I2S_ID = 1
-    BUFFER_LENGTH_IN_BYTES = 40000
-    # ======= I2S CONFIGURATION =======
-
-else:
-    print("Warning: program not tested with this board")
+# board detection, I2S pin assignments and SD card setup are shared by
+# all examples:  see board_config.py
+board_config.mount_sd()
 
 # ======= AUDIO CONFIGURATION =======
 WAV_FILE = "mic.wav"
@@ -114,79 +35,167 @@ SAMPLE_RATE_IN_HZ = 22050
 format_to_channels = {I2S.MONO: 1, I2S.STEREO: 2}
 NUM_CHANNELS = format_to_channels[FORMAT]
 WAV_SAMPLE_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BITS // 8
+
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough runway to ride out a worst-case SD card write stall
+# (cheap cards can freeze a write for hundreds of ms during internal flash
+# housekeeping), rounded up to a whole number of 4096 byte FAT clusters.
+# The software SPI SD driver on the RP2040 gets a larger budget still
+TARGET_LATENCY_IN_MS = 1500 if board_config.PLATFORM == "Raspberry" else 1000
+FRAME_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
+BUFFER_LENGTH_IN_BYTES = (
+    SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 4095
+) & ~4095
 RECORDING_SIZE_IN_BYTES = (
     RECORD_TIME_IN_SECONDS * SAMPLE_RATE_IN_HZ * WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
 )
 
 
 def create_wav_header(sampleRate, bitsPerSample, num_channels, num_samples):
-    datasize = num_samples * num_channels * bitsPerSample // 8
-    o = bytes("RIFF", "ascii")  # (4byte) Marks file as RIFF
-    o += (datasize + 36).to_bytes(
-        4, "little"
-    )  # (4byte) File size in bytes excluding this and RIFF marker
-    o += bytes("WAVE", "ascii")  # (4byte) File type
-    o += bytes("fmt ", "ascii")  # (4byte) Format Chunk Marker
-    o += (16).to_bytes(4, "little")  # (4byte) Length of above format data
-    o += (1).to_bytes(2, "little")  # (2byte) Format type (1 - PCM)
-    o += (num_channels).to_bytes(2, "little")  # (2byte)
-    o += (sampleRate).to_bytes(4, "little")  # (4byte)
-    o += (sampleRate * num_channels * bitsPerSample // 8).to_bytes(4, "little")  # (4byte)
-    o += (num_channels * bitsPerSample // 8).to_bytes(2, "little")  # (2byte)
-    o += (bitsPerSample).to_bytes(2, "little")  # (2byte)
-    o += bytes("data", "ascii")  # (4byte) Data Chunk Marker
-    o += (datasize).to_bytes(4, "little")  # (4byte) Data size in bytes
-    return o
+    # emit the complete 44 byte header with one struct.pack() call:  the
+    # repeated bytes concatenation it replaces made over 20 heap
+    # allocations to build one header
+    # the block align and byte rate fields are both derived from the same
+    # bytes-per-frame product:  compute it once and reuse it
+    block_align = num_channels * bitsPerSample // 8
+    byte_rate = sampleRate * block_align
+    datasize = num_samples * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",  # (4byte) Marks file as RIFF
+        datasize + 36,  # (4byte) File size in bytes excluding this and RIFF marker
+        b"WAVE",  # (4byte) File type
+        b"fmt ",  # (4byte) Format Chunk Marker
+        16,  # (4byte) Length of above format data
+        1,  # (2byte) Format type (1 - PCM)
+        num_channels,  # (2byte)
+        sampleRate,  # (4byte)
+        byte_rate,  # (4byte)
+        block_align,  # (2byte)
+        bitsPerSample,  # (2byte)
+        b"data",  # (4byte) Data Chunk Marker
+        datasize,  # (4byte) Data size in bytes
+    )
+
+
+# build the 44 byte header once at import:  the sample rate, bit depth and
+# channel count are fixed, so only the two size fields need to be patched
+# in once the actual number of recorded bytes is known
+WAV_HEADER = bytearray(
+    create_wav_header(SAMPLE_RATE_IN_HZ, WAV_SAMPLE_SIZE_IN_BITS, NUM_CHANNELS, 0)
+)
+
+
+class BufferedWriter:
+    # coalesce small writes into a sector-multiple staging buffer:  the FAT
+    # layer (cluster lookup, allocation, directory updates) is traversed
+    # once per 32768 byte burst instead of once per sample buffer, and the
+    # SD card sees large sequential writes
+    def __init__(self, f, size=32768):
+        self.f = f
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+
+    def write(self, mv):
+        num_bytes = len(mv)
+        if self.pos + num_bytes > len(self.buf):
+            self.flush()
+        if num_bytes >= len(self.buf):
+            # oversized write:  no point staging, pass it straight through
+            return self.f.write(mv)
+        self.mv[self.pos : self.pos + num_bytes] = mv
+        self.pos += num_bytes
+        return num_bytes
+
+    def flush(self):
+        if self.pos > 0:
+            _ = self.f.write(self.mv[: self.pos])
+            self.pos = 0
 
 
 async def record_wav_to_sdcard(audio_in, wav):
-    sreader = asyncio.StreamReader(audio_in)
-
-    # create header for WAV file and write to SD card
-    wav_header = create_wav_header(
-        SAMPLE_RATE_IN_HZ,
-        WAV_SAMPLE_SIZE_IN_BITS,
-        NUM_CHANNELS,
-        SAMPLE_RATE_IN_HZ * RECORD_TIME_IN_SECONDS,
-    )
-    num_bytes_written = wav.write(wav_header)
+    # wake this coroutine straight from the I2S interrupt:  the irq sets a
+    # ThreadSafeFlag, so the task is woken exactly once per completed DMA
+    # transfer.  The StreamReader path it replaces re-entered the event
+    # loop's poll machinery on every scheduler pass
+    flag = asyncio.ThreadSafeFlag()
+    audio_in.irq(lambda arg: flag.set())
+
+    # stage sample buffers through a 32 KiB write coalescer
+    bwav = BufferedWriter(wav)
 
-    # allocate sample array
+    # write the header template to reserve its 44 bytes;  the size fields
+    # are patched in after the recording ends
+    num_bytes_written = wav.write(WAV_HEADER)
+
+    # allocate two sample buffers
     # memoryview used to reduce heap allocation
-    mic_samples = bytearray(10000)
-    mic_samples_mv = memoryview(mic_samples)
+    # 8192 divides the FAT cluster and SD erase-block sizes, so each write
+    # lands on filesystem boundaries instead of straddling them
+    mic_samples = [bytearray(8192), bytearray(8192)]
+    mic_samples_mv = [memoryview(b) for b in mic_samples]
+    i = 0
 
     num_sample_bytes_written_to_wav = 0
 
+    async def flush(mv, num_bytes):
+        # write a filled buffer to the WAV file.  The write itself is
+        # blocking, but running it as a separate task means it executes
+        # while the acquisition loop is awaiting the next buffer of
+        # samples, instead of serializing behind it
+        nonlocal num_sample_bytes_written_to_wav
+        # the whole buffer is written in the common case, with no
+        # memoryview slice allocated on the hot path;  the slice is
+        # only needed for the truncated final write
+        if num_bytes == len(mv):
+            num_sample_bytes_written_to_wav += bwav.write(mv)
+        else:
+            num_sample_bytes_written_to_wav += bwav.write(mv[:num_bytes])
+
     # continuously read audio samples from I2S hardware
-    # and write them to a WAV file stored on a SD card
+    # and write them to a WAV file stored on a SD card.  The two buffers
+    # ping-pong:  while one is being written to the SD card the other is
+    # being filled from the microphone
     print("Recording size: {} bytes".format(RECORDING_SIZE_IN_BYTES))
     print("==========  START RECORDING ==========")
-    while num_sample_bytes_written_to_wav < RECORDING_SIZE_IN_BYTES:
-        # read samples from the I2S peripheral
-        num_bytes_read_from_mic = await sreader.readinto(mic_samples_mv)
-        # write samples to WAV file
-        if num_bytes_read_from_mic > 0:
-            num_bytes_to_write = min(
-                num_bytes_read_from_mic, RECORDING_SIZE_IN_BYTES - num_sample_bytes_written_to_wav
-            )
-            num_bytes_written = wav.write(mic_samples_mv[:num_bytes_to_write])
-            num_sample_bytes_written_to_wav += num_bytes_written
+    num_sample_bytes_read = 0
+    flush_task = None
+    # prime the first capture;  with an irq attached, readinto() returns
+    # immediately and the flag is set when the buffer has been filled
+    _ = audio_in.readinto(mic_samples_mv[i])
+    while num_sample_bytes_read < RECORDING_SIZE_IN_BYTES:
+        # wait for the DMA to fill the current buffer
+        await flag.wait()
+        filled = i
+        i ^= 1
+        # re-arm the capture into the other buffer before starting the SD
+        # write, so the microphone is never left without a destination
+        _ = audio_in.readinto(mic_samples_mv[i])
+        num_bytes_to_write = min(
+            len(mic_samples_mv[filled]), RECORDING_SIZE_IN_BYTES - num_sample_bytes_read
+        )
+        num_sample_bytes_read += num_bytes_to_write
+        flush_task = asyncio.create_task(flush(mic_samples_mv[filled], num_bytes_to_write))
+
+    # wait for the final buffer to reach the SD card
+    if flush_task:
+        await flush_task
+
+    # push the staged tail of the recording out to the SD card
+    bwav.flush()
 
     print("==========  DONE RECORDING ==========")
+    # patch the header template with the actual recording size.  pack_into()
+    # writes the two size fields in place:  no header object is rebuilt
+    datasize = num_sample_bytes_written_to_wav
+    struct.pack_into("<I", WAV_HEADER, 4, datasize + 36)
+    struct.pack_into("<I", WAV_HEADER, 40, datasize)
+    _ = wav.seek(0)
+    _ = wav.write(WAV_HEADER)
     # cleanup
     wav.close()
-    if os.uname().machine.count("PYBD"):
-        os.umount("/sd")
-    elif os.uname().machine.count("ESP32"):
-        os.umount("/sd")
-        sd.deinit()
-    elif os.uname().machine.count("Raspberry"):
-        os.umount("/sd")
-        spi.deinit()
-    elif os.uname().machine.count("MIMXRT"):
-        os.umount("/sd")
-        sd.deinit()
+    board_config.umount_sd()
     audio_in.deinit()
 
 
@@ -194,7 +203,10 @@ async def another_task(name):
     while True:
         await asyncio.sleep(urandom.randrange(2, 5))
         print("{} woke up".format(name))
-        time.sleep_ms(10)  # simulates task doing something
+        # simulates task doing something.  Note:  a coroutine must never use
+        # the blocking time.sleep_ms() - it stalls the scheduler and starves
+        # the record coroutine's SD writes
+        await asyncio.sleep_ms(10)
 
 
 async def main(audio_in, wav):
@@ -208,11 +220,16 @@ async def main(audio_in, wav):
 
 
 try:
+    # create the pin objects once, ahead of the constructor call
+    sck_pin = Pin(board_config.RX_SCK_PIN)
+    ws_pin = Pin(board_config.RX_WS_PIN)
+    sd_pin = Pin(board_config.RX_SD_PIN)
+
     audio_in = I2S(
-        I2S_ID,
-        sck=Pin(SCK_PIN),
-        ws=Pin(WS_PIN),
-        sd=Pin(SD_PIN),
+        board_config.RX_I2S_ID,
+        sck=sck_pin,
+        ws=ws_pin,
+        sd=sd_pin,
         mode=I2S.RX,
         bits=WAV_SAMPLE_SIZE_IN_BITS,
         format=FORMAT,
@@ -220,23 +237,16 @@ try:
         ibuf=BUFFER_LENGTH_IN_BYTES,
     )
 
-    wav = open("/sd/{}".format(WAV_FILE), "wb")
+    # MicroPython VFS file objects write straight through to the FatFS
+    # sector cache:  there is no CPython-style file-object buffer, so no
+    # buffering= argument is needed to avoid double-buffering
+    wav = open("/sd/" + WAV_FILE, "wb")
     asyncio.run(main(audio_in, wav))
 except (KeyboardInterrupt, Exception) as e:
-    print("Exception {} {}\n".format(type(e).__name__, e))
+    print("Exception", type(e).__name__, e)
 finally:
     # cleanup
     wav.close()
-    if os.uname().machine.count("PYBD"):
-        os.umount("/sd")
-    elif os.uname().machine.count("ESP32"):
-        os.umount("/sd")
-        sd.deinit()
-    elif os.uname().machine.count("Raspberry"):
-        os.umount("/sd")
-        spi.deinit()
-    elif os.uname().machine.count("MIMXRT"):
-        os.umount("/sd")
-        sd.deinit()
+    board_config.umount_sd()
     audio_in.deinit()
     ret = asyncio.new_event_loop()  # Clear retained uasyncio state
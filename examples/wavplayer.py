@@ -21,9 +21,14 @@
 # The WAV file header is parsed in the play() method to get audio parameters
 
 import os
-import struct
 from machine import I2S
 
+# one module-wide run of silence, shared by every WavPlayer instance.
+# Nothing ever writes into it, so an immutable zero-initialized bytes
+# object is enough, and 2048 bytes halves the number of silence writes
+# needed to flush the internal I2S buffer
+_SILENCE = bytes(2048)
+
 
 class WavPlayer:
     PLAY = 0
@@ -46,51 +51,90 @@ class WavPlayer:
         self.sample_rate = None
         self.bits_per_sample = None
         self.first_sample_offset = None
-        self.num_read = 0
-        self.sbuf = 1000
         self.nflush = 0
 
-        # allocate a small array of blank audio samples used for silence
-        self.silence_samples = bytearray(self.sbuf)
+        # allocate two audio sample array buffers, used ping-pong:  the I2S
+        # peripheral drains one while the other is refilled from the SD
+        # card, so an SD card read stall eats into a full buffer of slack
+        # instead of starving the DMA
+        # sized to a multiple of the 512 byte SD card sector and the I2S sample frame
+        self.wav_samples_mv = [memoryview(bytearray(10240)), memoryview(bytearray(10240))]
+        self.filled = [0, 0]
+        self.idx = 0
+
+        # handler table indexed by state:  the PLAY..STOP constants form
+        # the compact range 0..4, so the IRQ callback dispatches with one
+        # indexed load instead of a chain of comparisons
+        self._handlers = [
+            self._on_play,
+            self._on_pause,
+            self._on_resume,
+            self._on_flush,
+            self._on_stop,
+        ]
+
+    def _on_play(self):
+        # write the buffer filled on the previous pass, then refill the
+        # other buffer for the next pass
+        idx = self.idx
+        num_filled = self.filled[idx]
+        if num_filled == 0:
+            _ = self.audio_out.write(_SILENCE)
+        elif num_filled == len(self.wav_samples_mv[idx]):
+            # in the common case a full buffer was read, and it is
+            # written whole:  slicing the memoryview would allocate a
+            # new object inside the callback on every audio block
+            _ = self.audio_out.write(self.wav_samples_mv[idx])
+        else:
+            _ = self.audio_out.write(self.wav_samples_mv[idx][:num_filled])
+        idx ^= 1
+        self.idx = idx
+        num_read = self.wav.readinto(self.wav_samples_mv[idx])
+        # end of WAV file?
+        if self.loop:
+            if num_read < len(self.wav_samples_mv[idx]):
+                # end-of-file:  wrap to the first byte of the Data section
+                # and fill the tail of the buffer with the start of the
+                # next pass.  Stitching keeps every looped write a uniform
+                # full buffer of real audio - restarting with a fresh read
+                # left a short or empty buffer at the seam, heard as a
+                # click on every loop iteration
+                _ = self.wav.seek(self.first_sample_offset)
+                num_read += self.wav.readinto(self.wav_samples_mv[idx][num_read:])
+        elif num_read == 0:
+            # end-of-file
+            self.state = WavPlayer.FLUSH
+        self.filled[idx] = num_read
+
+    def _on_pause(self):
+        _ = self.audio_out.write(_SILENCE)
+
+    def _on_resume(self):
+        self.state = WavPlayer.PLAY
+        _ = self.audio_out.write(_SILENCE)
+
+    def _on_flush(self):
+        # Flush is used to allow the residual audio samples in the
+        # internal buffer to be written to the I2S peripheral.  This step
+        # avoids part of the sound file from being cut off
+        if self.nflush > 0:
+            self.nflush -= 1
+            _ = self.audio_out.write(_SILENCE)
+        else:
+            self.wav.close()
+            self.audio_out.deinit()
+            self.state = WavPlayer.STOP
 
-        # allocate audio sample array buffer
-        self.wav_samples_mv = memoryview(bytearray(10000))
+    def _on_stop(self):
+        pass
 
     def i2s_callback(self, arg):
-        if self.state == WavPlayer.PLAY:
-            self.num_read = self.wav.readinto(self.wav_samples_mv)
-            # end of WAV file?
-            if self.num_read == 0:
-                # end-of-file
-                if self.loop == False:
-                    self.state = WavPlayer.FLUSH
-                else:
-                    # advance to first byte of Data section
-                    _ = self.wav.seek(self.first_sample_offset)
-                _ = self.audio_out.write(self.silence_samples)
-            else:
-                _ = self.audio_out.write(self.wav_samples_mv[: self.num_read])
-        elif self.state == WavPlayer.RESUME:
-            self.state = WavPlayer.PLAY
-            _ = self.audio_out.write(self.silence_samples)
-        elif self.state == WavPlayer.PAUSE:
-            _ = self.audio_out.write(self.silence_samples)
-        elif self.state == WavPlayer.FLUSH:
-            # Flush is used to allow the residual audio samples in the
-            # internal buffer to be written to the I2S peripheral.  This step
-            # avoids part of the sound file from being cut off
-            if self.nflush > 0:
-                self.nflush -= 1
-                _ = self.audio_out.write(self.silence_samples)
-            else:
-                self.wav.close()
-                self.audio_out.deinit()
-                self.state = WavPlayer.STOP
-        elif self.state == WavPlayer.STOP:
-            pass
-        else:
-            raise SystemError("Internal error:  unexpected state")
-            self.state == WavPlayer.STOP
+        # dispatch through the handler table:  one indexed load instead of
+        # up to four state comparisons per DMA-completion interrupt.  All
+        # state transitions are internal, so the state is always a valid
+        # table index - and raising from an IRQ context would kill the
+        # audio pipeline anyway
+        self._handlers[self.state]()
 
     def parse(self, wav_file):
         chunk_ID = wav_file.read(4)
@@ -104,18 +148,20 @@ class WavPlayer:
         if sub_chunk1_ID != b"fmt ":
             raise ValueError("WAV sub chunk 1 ID invalid")
         sub_chunk1_size = wav_file.read(4)
-        audio_format = struct.unpack("<H", wav_file.read(2))[0]
-        num_channels = struct.unpack("<H", wav_file.read(2))[0]
+
+        # read the 16 byte fmt subchunk with a single call and decode the
+        # fields with int.from_bytes():  the struct.unpack() chain it
+        # replaces made six file reads and allocated six 1-tuples
+        fmt = wav_file.read(16)
+        num_channels = int.from_bytes(fmt[2:4], "little")
 
         if num_channels == 1:
             self.format = I2S.MONO
         else:
             self.format = I2S.STEREO
 
-        self.sample_rate = struct.unpack("<I", wav_file.read(4))[0]
-        byte_rate = struct.unpack("<I", wav_file.read(4))[0]
-        block_align = struct.unpack("<H", wav_file.read(2))[0]
-        self.bits_per_sample = struct.unpack("<H", wav_file.read(2))[0]
+        self.sample_rate = int.from_bytes(fmt[4:8], "little")
+        self.bits_per_sample = int.from_bytes(fmt[14:16], "little")
 
         # usually the sub chunk2 ID ("data") comes next, but
         # some online MP3->WAV converters add
@@ -130,7 +176,11 @@ class WavPlayer:
         self.first_sample_offset = 44 + offset
 
     def play(self, wav_file, loop=False):
-        if os.listdir(self.root).count(wav_file) == 0:
+        # stat the file directly:  listing the whole directory allocated a
+        # list of every entry on the card just to test for one name
+        try:
+            os.stat(self.root + wav_file)
+        except OSError:
             raise ValueError("%s: not found" % wav_file)
         if self.state == WavPlayer.PLAY:
             raise ValueError("already playing a WAV file")
@@ -156,9 +206,14 @@ class WavPlayer:
             # advance to first byte of Data section in WAV file
             _ = self.wav.seek(self.first_sample_offset)
             self.audio_out.irq(self.i2s_callback)
-            self.nflush = self.ibuf // self.sbuf + 1
+            self.nflush = self.ibuf // len(_SILENCE) + 1
+            # pre-fill the first buffer so the first callback pass writes
+            # real audio while the second buffer is being read
+            self.filled[0] = self.wav.readinto(self.wav_samples_mv[0])
+            self.filled[1] = 0
+            self.idx = 0
             self.state = WavPlayer.PLAY
-            _ = self.audio_out.write(self.silence_samples)
+            _ = self.audio_out.write(_SILENCE)
 
     def resume(self):
         if self.state != WavPlayer.PAUSE:
@@ -12,15 +12,36 @@
 # blocking version
 # - the write() method blocks until the entire sample buffer is written to the I2S interface
 #
-# requires a MicroPython driver for the SGTL5000 codec
+# requires the MicroPython driver for the SGTL5000 codec, included in
+# this folder:  copy sgtl5000.py to the board's file system
 
 import os
+import struct
 from machine import I2C
 from machine import I2S
 from machine import Pin
 from machine import SDCard
 from sgtl5000 import CODEC
 
+
+def parse_wav_header(wav_file):
+    # parse the WAV file header and return the offset and length of the Data
+    # section.  Walking the RIFF chunks is more robust than the often-seen
+    # seek(44):  WAV files written by many audio tools contain extra chunks
+    # (e.g. LIST/INFO) ahead of the Data chunk
+    chunk_id, _, format = struct.unpack("<4sI4s", wav_file.read(12))
+    if chunk_id != b"RIFF" or format != b"WAVE":
+        raise ValueError("invalid WAV file")
+    while True:
+        header = wav_file.read(8)
+        if len(header) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"data":
+            return wav_file.tell(), chunk_size
+        _ = wav_file.seek(chunk_size, 1)  # skip over this chunk
+
+
 sd = SDCard(1)  # Teensy 4.1: sck=45, mosi=43, miso=42, cs=44
 os.mount(sd, "/sd")
 
@@ -28,9 +49,8 @@ os.mount(sd, "/sd")
 SCK_PIN = 21
 WS_PIN = 20
 SD_PIN = 7
-MCK_PIN = 23
+MCK_PIN = 23  # I2S peripheral generates MCLK = 256 x fs, as the SGTL5000 requires
 I2S_ID = 1
-BUFFER_LENGTH_IN_BYTES = 40000
 # ======= I2S CONFIGURATION =======
 
 # ======= AUDIO CONFIGURATION =======
@@ -40,12 +60,28 @@ FORMAT = I2S.STEREO
 SAMPLE_RATE_IN_HZ = 44100
 # ======= AUDIO CONFIGURATION =======
 
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough audio to ride out SD card latency spikes and GC pauses,
+# rounded up to a whole number of 512 byte SD card sectors.  A fixed 40000
+# bytes was 625 ms of audio at 16 kHz mono - wasted RAM on small boards
+TARGET_LATENCY_IN_MS = 150
+FRAME_SIZE_IN_BYTES = (WAV_SAMPLE_SIZE_IN_BITS // 8) * (2 if FORMAT == I2S.STEREO else 1)
+BUFFER_LENGTH_IN_BYTES = max(
+    512, (SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 511) & ~511
+)
+
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(SCK_PIN)
+ws_pin = Pin(WS_PIN)
+sd_pin = Pin(SD_PIN)
+mck_pin = Pin(MCK_PIN)
+
 audio_out = I2S(
     I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
-    mck=Pin(MCK_PIN),
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
+    mck=mck_pin,
     mode=I2S.TX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -53,21 +89,38 @@ audio_out = I2S(
     ibuf=BUFFER_LENGTH_IN_BYTES,
 )
 
-# configure the SGTL5000 codec
+def init_codec(i2c):
+    # configure the SGTL5000 codec.  All register writes happen here, before
+    # playback starts, so no I2C traffic competes with the audio stream.
+    # The DAC and headphone outputs are muted while the volume registers are
+    # written and unmuted last, avoiding audible pops
+    codec = CODEC(0x0A, i2c)
+    codec.mute_dac(True)
+    codec.mute_headphone(True)
+    codec.dac_volume(0.9, 0.9)
+    codec.headphone_select(0)
+    codec.volume(0.7, 0.7)
+    codec.mute_dac(False)
+    codec.mute_headphone(False)
+    return codec
+
+
 i2c = I2C(0, freq=400000)
-codec = CODEC(0x0A, i2c)
-codec.mute_dac(False)
-codec.dac_volume(0.9, 0.9)
-codec.headphone_select(0)
-codec.mute_headphone(False)
-codec.volume(0.7, 0.7)
+codec = init_codec(i2c)
+# codec configuration is done:  drop the I2C bus to 100 kHz.  Codec writes
+# are infrequent from here on, and Standard-mode is more tolerant of long
+# wires than Fast-mode
+i2c.init(freq=100_000)
 
-wav = open("/sd/{}".format(WAV_FILE), "rb")
-_ = wav.seek(44)  # advance to first byte of Data section in WAV file
+wav = open("/sd/" + WAV_FILE, "rb")
+# locate the Data section once, then cache the offset and end position
+data_offset, data_len = parse_wav_header(wav)
+data_end = data_offset + data_len
 
 # allocate sample array
 # memoryview used to reduce heap allocation
-wav_samples = bytearray(10000)
+# sized to a multiple of the 512 byte SD card sector and the I2S sample frame
+wav_samples = bytearray(10240)
 wav_samples_mv = memoryview(wav_samples)
 
 # continuously read audio samples from the WAV file
@@ -75,15 +128,19 @@ wav_samples_mv = memoryview(wav_samples)
 print("==========  START PLAYBACK ==========")
 try:
     while True:
-        num_read = wav.readinto(wav_samples_mv)
+        # bound each read to the end of the Data section:  the final read is
+        # then exact-length rather than a short read that FatFS must bounce,
+        # and trailing chunks (if any) are never played as audio samples
+        to_read = min(len(wav_samples), data_end - wav.tell())
         # end of WAV file?
-        if num_read == 0:
+        if to_read == 0:
             # end-of-file, advance to first byte of Data section
-            _ = wav.seek(44)
+            _ = wav.seek(data_offset)
         else:
+            num_read = wav.readinto(wav_samples_mv[:to_read])
             _ = audio_out.write(wav_samples_mv[:num_read])
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
 wav.close()
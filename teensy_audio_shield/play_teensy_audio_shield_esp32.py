@@ -13,8 +13,8 @@
 # blocking version
 # - the write() method blocks until the entire sample buffer is written to the I2S interface
 #
-# Requires a MicroPython driver for the SGTL5000 codec.  Copy sgtl5000.py to the file system.
-#   https://github.com/rdagger/micropython-sgtl5000
+# Requires the MicroPython driver for the SGTL5000 codec, included in
+# this folder:  copy sgtl5000.py to the board's file system.
 #
 # This example code was tested on a Lolin D32 Pro ESP32 board, but can 
 # be run on other boards with minor changes to SD card, I2C, and I2S pin assignments.
@@ -38,7 +38,6 @@ WS_PIN = 25
 SD_PIN = 32
 MCK_PIN = 5
 I2S_ID = 1
-BUFFER_LENGTH_IN_BYTES = 40000
 # ======= I2S CONFIGURATION =======
 
 # ======= AUDIO CONFIGURATION =======
@@ -48,11 +47,26 @@ FORMAT = I2S.STEREO
 SAMPLE_RATE_IN_HZ = 44100
 # ======= AUDIO CONFIGURATION =======
 
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough audio to ride out SD card latency spikes and GC pauses,
+# rounded up to a whole number of 512 byte SD card sectors.  A fixed 40000
+# bytes was 625 ms of audio at 16 kHz mono - wasted RAM on small boards
+TARGET_LATENCY_IN_MS = 150
+FRAME_SIZE_IN_BYTES = (WAV_SAMPLE_SIZE_IN_BITS // 8) * (2 if FORMAT == I2S.STEREO else 1)
+BUFFER_LENGTH_IN_BYTES = max(
+    512, (SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 511) & ~511
+)
+
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(SCK_PIN)
+ws_pin = Pin(WS_PIN)
+sd_pin = Pin(SD_PIN)
+
 audio_out = I2S(
     I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
     mode=I2S.TX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -64,6 +78,14 @@ audio_out = I2S(
 # important note:  the SGTL5000 device must have a master clock *BEFORE* I2C will work
 pwm = PWM(Pin(MCK_PIN), freq=SAMPLE_RATE_IN_HZ*256, duty_u16=32768)
 
+# verify the master clock the PWM actually produced:  the SGTL5000 needs
+# MCLK = 256, 384, or 512 x fs.  A mis-set MCLK causes distorted audio that
+# is easy to misdiagnose as an undersized ibuf
+mclk_freq = pwm.freq()
+print("MCLK = {} Hz ({}% of 256 x fs)".format(mclk_freq, 100 * mclk_freq // (SAMPLE_RATE_IN_HZ * 256)))
+if mclk_freq % SAMPLE_RATE_IN_HZ != 0 or mclk_freq // SAMPLE_RATE_IN_HZ not in (256, 384, 512):
+    print("Warning: MCLK is not a valid multiple of the sample rate")
+
 # configure the SGTL5000 codec
 i2c = I2C(0, sda=Pin(26), scl=Pin(27), freq=400000)
 codec = CODEC(0x0A, i2c)
@@ -73,12 +95,13 @@ codec.headphone_select(0)
 codec.mute_headphone(False)
 codec.volume(0.7, 0.7)
 
-wav = open("/sd/{}".format(WAV_FILE), "rb")
+wav = open("/sd/" + WAV_FILE, "rb")
 _ = wav.seek(44)  # advance to first byte of Data section in WAV file
 
 # allocate sample array
 # memoryview used to reduce heap allocation
-wav_samples = bytearray(10000)
+# sized to a multiple of the 512 byte SD card sector and the I2S sample frame
+wav_samples = bytearray(10240)
 wav_samples_mv = memoryview(wav_samples)
 
 # continuously read audio samples from the WAV file
@@ -87,14 +110,16 @@ print("==========  START PLAYBACK ==========")
 try:
     while True:
         num_read = wav.readinto(wav_samples_mv)
-        # end of WAV file?
-        if num_read == 0:
-            # end-of-file, advance to first byte of Data section
+        if num_read < len(wav_samples_mv):
+            # end-of-file:  wrap to the first byte of the Data section and
+            # fill the tail of the buffer with the start of the next pass,
+            # so every write below is a uniform full-size buffer instead of
+            # a short fragment followed by a small extra write
             _ = wav.seek(44)
-        else:
-            _ = audio_out.write(wav_samples_mv[:num_read])
+            num_read += wav.readinto(wav_samples_mv[num_read:])
+        _ = audio_out.write(wav_samples_mv)
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
 wav.close()
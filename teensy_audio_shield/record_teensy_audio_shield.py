@@ -14,9 +14,11 @@
 # - the readinto() method blocks until
 #   the supplied buffer is filled
 #
-# requires a MicroPython driver for the SGTL5000 codec
+# requires the MicroPython driver for the SGTL5000 codec, included in
+# this folder:  copy sgtl5000.py to the board's file system
 
 import os
+import struct
 import time
 from machine import I2C
 from machine import I2S
@@ -33,7 +35,6 @@ WS_PIN = 20
 SD_PIN = 8
 MCK_PIN = 23
 I2S_ID = 1
-BUFFER_LENGTH_IN_BYTES = 100000
 # ======= I2S CONFIGURATION =======
 
 # ======= AUDIO CONFIGURATION =======
@@ -47,31 +48,46 @@ SAMPLE_RATE_IN_HZ = 44100
 format_to_channels = {I2S.MONO: 1, I2S.STEREO: 2}
 NUM_CHANNELS = format_to_channels[FORMAT]
 WAV_SAMPLE_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BITS // 8
+
+# size the internal I2S buffer from a time-based budget instead of a fixed
+# byte count:  enough runway to ride out a worst-case SD card write stall
+# (cheap cards can freeze a write for hundreds of ms during internal flash
+# housekeeping), rounded up to a whole number of 4096 byte FAT clusters
+TARGET_LATENCY_IN_MS = 1000
+FRAME_SIZE_IN_BYTES = WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
+BUFFER_LENGTH_IN_BYTES = (
+    SAMPLE_RATE_IN_HZ * FRAME_SIZE_IN_BYTES * TARGET_LATENCY_IN_MS // 1000 + 4095
+) & ~4095
 RECORDING_SIZE_IN_BYTES = (
     RECORD_TIME_IN_SECONDS * SAMPLE_RATE_IN_HZ * WAV_SAMPLE_SIZE_IN_BYTES * NUM_CHANNELS
 )
 
 def create_wav_header(sampleRate, bitsPerSample, num_channels, num_samples):
-    datasize = num_samples * num_channels * bitsPerSample // 8
-    o = bytes("RIFF", "ascii")  # (4byte) Marks file as RIFF
-    o += (datasize + 36).to_bytes(
-        4, "little"
-    )  # (4byte) File size in bytes excluding this and RIFF marker
-    o += bytes("WAVE", "ascii")  # (4byte) File type
-    o += bytes("fmt ", "ascii")  # (4byte) Format Chunk Marker
-    o += (16).to_bytes(4, "little")  # (4byte) Length of above format data
-    o += (1).to_bytes(2, "little")  # (2byte) Format type (1 - PCM)
-    o += (num_channels).to_bytes(2, "little")  # (2byte)
-    o += (sampleRate).to_bytes(4, "little")  # (4byte)
-    o += (sampleRate * num_channels * bitsPerSample // 8).to_bytes(4, "little")  # (4byte)
-    o += (num_channels * bitsPerSample // 8).to_bytes(2, "little")  # (2byte)
-    o += (bitsPerSample).to_bytes(2, "little")  # (2byte)
-    o += bytes("data", "ascii")  # (4byte) Data Chunk Marker
-    o += (datasize).to_bytes(4, "little")  # (4byte) Data size in bytes
-    return o
-
-
-wav = open("/sd/{}".format(WAV_FILE), "wb")
+    # emit the complete 44 byte header with one struct.pack() call:  the
+    # repeated bytes concatenation it replaces made over 20 heap
+    # allocations to build one header
+    block_align = num_channels * bitsPerSample // 8
+    byte_rate = sampleRate * block_align
+    datasize = num_samples * block_align
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",  # (4byte) Marks file as RIFF
+        datasize + 36,  # (4byte) File size in bytes excluding this and RIFF marker
+        b"WAVE",  # (4byte) File type
+        b"fmt ",  # (4byte) Format Chunk Marker
+        16,  # (4byte) Length of above format data
+        1,  # (2byte) Format type (1 - PCM)
+        num_channels,  # (2byte)
+        sampleRate,  # (4byte)
+        byte_rate,  # (4byte)
+        block_align,  # (2byte)
+        bitsPerSample,  # (2byte)
+        b"data",  # (4byte) Data Chunk Marker
+        datasize,  # (4byte) Data size in bytes
+    )
+
+
+wav = open("/sd/" + WAV_FILE, "wb")
 
 # create header for WAV file and write to SD card
 wav_header = create_wav_header(
@@ -82,12 +98,18 @@ wav_header = create_wav_header(
 )
 num_bytes_written = wav.write(wav_header)
 
+# create the pin objects once, ahead of the constructor call
+sck_pin = Pin(SCK_PIN)
+ws_pin = Pin(WS_PIN)
+sd_pin = Pin(SD_PIN)
+mck_pin = Pin(MCK_PIN)
+
 audio_in = I2S(
     I2S_ID,
-    sck=Pin(SCK_PIN),
-    ws=Pin(WS_PIN),
-    sd=Pin(SD_PIN),
-    mck=Pin(MCK_PIN),
+    sck=sck_pin,
+    ws=ws_pin,
+    sd=sd_pin,
+    mck=mck_pin,
     mode=I2S.RX,
     bits=WAV_SAMPLE_SIZE_IN_BITS,
     format=FORMAT,
@@ -105,7 +127,9 @@ codec.mic_gain(20)
 
 # allocate sample arrays
 # memoryview used to reduce heap allocation in while loop
-mic_samples = bytearray(10000)
+# 8192 divides the FAT cluster and SD erase-block sizes, so each write
+# lands on filesystem boundaries instead of straddling them
+mic_samples = bytearray(8192)
 mic_samples_mv = memoryview(mic_samples)
 
 num_sample_bytes_written_to_wav = 0
@@ -126,7 +150,7 @@ try:
 
     print("==========  DONE RECORDING ==========")
 except (KeyboardInterrupt, Exception) as e:
-    print("caught exception {} {}".format(type(e).__name__, e))
+    print("caught exception", type(e).__name__, e)
 
 # cleanup
 wav.close()
@@ -0,0 +1,963 @@
+# The MIT License (MIT)
+# Copyright (c) 2022 rdagger
+# https://opensource.org/licenses/MIT
+#
+# MicroPython driver for the SGTL5000 audio codec, used on the
+# Teensy Audio Shield, Rev D
+# adapted from https://github.com/rdagger/micropython-sgtl5000
+#
+# register values and the power-up sequence follow the NXP SGTL5000
+# datasheet and the PJRC Audio Library control_sgtl5000 implementation
+
+import micropython
+import struct
+from math import cos, exp, pi, sin, sqrt
+from micropython import const
+from time import sleep_ms
+
+# auto volume control coefficient math:  the datasheet formulas are
+# powers of 10, but exp() is markedly cheaper than the generic pow()
+# path in MicroPython's math library, so the exponents are rescaled by
+# ln(10) once here.  20 * 44100 is the fixed scaling the SGTL5000
+# applies to the attack and decay rates
+_LN10_OVER_20 = 2.302585092994046 / 20
+_LN10_OVER_20FS = 2.302585092994046 / (20 * 44100)
+
+# dB-to-linear scale factors for calc_biquad():  exp(db * ln10/k)
+# replaces pow(10, db/k), which runs log+multiply+exp internally
+_K20 = 2.302585092994046 / 20
+_K40 = 2.302585092994046 / 40
+
+_PI = 3.141592653589793
+_TWO_PI = 6.283185307179586
+_HALF_PI = 1.5707963267948966
+
+
+@micropython.native
+def _fast_sin(x):
+    # degree-5 odd minimax polynomial (Hastings coefficients), maximum
+    # error about 7e-5:  the biquad coefficients quantize to 20-bit
+    # integers, so full libm precision is wasted on the trig section.
+    # range-reduce modulo 2*pi, then fold into [-pi/2, pi/2] where the
+    # polynomial holds, using sin(pi - x) == sin(x)
+    x = (x + _PI) % _TWO_PI - _PI
+    if x > _HALF_PI:
+        x = _PI - x
+    elif x < -_HALF_PI:
+        x = -_PI - x
+    x2 = x * x
+    return x * (0.9996949 + x2 * (-0.1656700 + x2 * 0.0075134))
+
+
+@micropython.native
+def _fast_cos(x):
+    return _fast_sin(_HALF_PI - x)
+
+
+# register addresses, module-level so the compiler folds each reference
+# into the bytecode as a small-int literal.  As class attributes every
+# access paid a class-dict lookup instead
+# Chip identification.
+# 15:8 PARTID (0xA0), 7:0 REVID.
+_CHIP_ID = const(0x0000)
+
+# Digital block power control.
+# 6 ADC_POWERUP, 5 DAC_POWERUP, 4 _DAP_POWERUP,
+# 1 I2S_OUT_POWERUP, 0 I2S_IN_POWERUP.
+_CHIP_DIG_POWER = const(0x0002)
+
+# Clocking control.
+# 5:4 RATE_MODE, 3:2 SYS_FS (0=32k, 1=44.1k, 2=48k, 3=96k),
+# 1:0 MCLK_FREQ (0=256*Fs, 1=384*Fs, 2=512*Fs, 3=PLL).
+_CHIP_CLK_CTRL = const(0x0004)
+
+# I2S port control.
+# 8 SCLKFREQ (0=64*Fs, 1=32*Fs), 7 MS master/slave,
+# 5:4 DLEN data length (0=32, 1=24, 2=20, 3=16 bits),
+# 3:2 I2S_MODE.
+_CHIP_I2S_CTRL = const(0x0006)
+
+# Sound switch (routing) control.
+# 7:6 _DAP_SELECT, 5:4 DAC_SELECT, 1:0 I2S_SELECT.
+# routes the ADC, I2S port and DAP in or out of the DAC path.
+_CHIP_SSS_CTRL = const(0x000A)
+
+# ADC and DAC control.
+# 9 VOL_RAMP_EN, 8 VOL_EXPO_RAMP,
+# 3 DAC_MUTE_RIGHT, 2 DAC_MUTE_LEFT,
+# 1 ADC_HPF_FREEZE, 0 ADC_HPF_BYPASS.
+_CHIP_ADCDAC_CTRL = const(0x000E)
+
+# DAC volume, left (7:0) and right (15:8).
+# 0x3C = 0 dB, 1 step = 0.5 dB down to 0xF0, 0xFC = muted.
+_CHIP_DAC_VOL = const(0x0010)
+
+# Pad drive strength for the digital pins.
+_CHIP_PAD_STRENGTH = const(0x0014)
+
+# ADC analog gain, left (3:0) and right (7:4), 1.5 dB steps.
+# 8 reduces the gain range by 6 dB for larger input signals.
+_CHIP_ANA_ADC_CTRL = const(0x0020)
+
+# Headphone volume, left (6:0) and right (14:8).
+# 0x00 = +12 dB, 0x18 = 0 dB, 0x7F = -51.5 dB, 0.5 dB steps.
+_CHIP_ANA_HP_CTRL = const(0x0022)
+
+# Analog block control.
+# 8 MUTE_LO, 6 SELECT_HP (0=DAC, 1=LINEIN), 5 EN_ZCD_HP,
+# 4 MUTE_HP, 2 SELECT_ADC (0=microphone, 1=LINEIN),
+# 1 EN_ZCD_ADC, 0 MUTE_ADC.
+_CHIP_ANA_CTRL = const(0x0024)
+
+# Linear regulator control:  charge pump source selection and
+# the VDDC regulator output level.
+_CHIP_LINREG_CTRL = const(0x0026)
+
+# Reference voltage and bias control.
+# 8:4 VAG_VAL analog ground level, 3:1 BIAS_CTRL, 0 SMALL_POP
+# for a slower reference ramp on power-up.
+_CHIP_REF_CTRL = const(0x0028)
+
+# Microphone control.
+# 9:8 BIAS_RESISTOR, 6:4 BIAS_VOLT, 1:0 preamp GAIN
+# (0=0 dB, 1=+20 dB, 2=+30 dB, 3=+40 dB).
+_CHIP_MIC_CTRL = const(0x002A)
+
+# Line out control:  output current (11:8) and the line out
+# analog ground voltage LO_VAGCNTRL (5:0).
+_CHIP_LINE_OUT_CTRL = const(0x002C)
+
+# Line out volume, left (4:0) and right (12:8).
+_CHIP_LINE_OUT_VOL = const(0x002E)
+
+# Analog block power control.
+# 14 LINREG_D_POWERUP, 10 PLL_POWERUP, 9 VCOAMP_POWERUP,
+# 8 VAG_POWERUP, 7 CURR_BIAS, 6 REFTOP_POWERUP, 5 LINEOUT,
+# 4 HEADPHONE, 3 DAC, 2 CAPLESS_HEADPHONE, 1 ADC, 0 LINEOUT.
+_CHIP_ANA_POWER = const(0x0030)
+
+_CHIP_PLL_CTRL = const(0x0032)
+_CHIP_CLK_TOP_CTRL = const(0x0034)
+_CHIP_ANA_STATUS = const(0x0036)
+_CHIP_ANA_TEST1 = const(0x0038)
+_CHIP_ANA_TEST2 = const(0x003A)
+
+# Short detect control:  headphone and center channel short
+# detector trip levels and automatic volume reduction.
+_CHIP_SHORT_CTRL = const(0x003C)
+
+# Digital audio processor control.
+# 4 MIX_EN, 0 _DAP_EN.  The DAP must also be routed into the
+# DAC path with _CHIP_SSS_CTRL.
+_DAP_CONTROL = const(0x0100)
+
+# Parametric EQ control, 2:0 EN_N_FILTERS (0=disabled).
+_DAP_PEQ = const(0x0102)
+
+# Bass enhance control.
+# 8 BYPASS_HPF, 6:4 CUTOFF (0=80Hz .. 6=225Hz), 0 EN.
+_DAP_BASS_ENHANCE = const(0x0104)
+
+# Bass enhance levels:  13:8 LR_LEVEL, 6:0 BASS_LEVEL.
+# both fields attenuate as the value increases.
+_DAP_BASS_ENHANCE_CTRL = const(0x0106)
+
+# Audio EQ select, 1:0 EN (0=disabled, 1=PEQ, 2=tone control,
+# 3=5-band graphic EQ).
+_DAP_AUDIO_EQ = const(0x0108)
+
+# Virtual surround control, 6:4 WIDTH_CONTROL, 1:0 SELECT.
+_DAP_SGTL_SURROUND = const(0x010A)
+
+# Filter coefficient access:  bit 8 WR loads the staged
+# coefficient registers into the filter INDEX in 3:0.
+_DAP_FILTER_COEF_ACCESS = const(0x010C)
+
+_DAP_COEF_WR_B0_MSB = const(0x010E)
+_DAP_COEF_WR_B0_LSB = const(0x0110)
+
+# Graphic EQ band 0 (115 Hz) level, 6:0.
+# 0x2F = 0 dB, one step = 0.25 dB.  Bands 1-4 (330 Hz, 990 Hz,
+# 3 kHz, 9.9 kHz) follow at successive even addresses.
+_DAP_AUDIO_EQ_BASS_BAND0 = const(0x0116)
+
+_DAP_AUDIO_EQ_BAND1 = const(0x0118)
+_DAP_AUDIO_EQ_BAND2 = const(0x011A)
+_DAP_AUDIO_EQ_BAND3 = const(0x011C)
+_DAP_AUDIO_EQ_TREBLE_BAND4 = const(0x011E)
+
+_DAP_MAIN_CHAN = const(0x0120)
+_DAP_MIX_CHAN = const(0x0122)
+
+# Auto volume control.
+# 13:12 MAX_GAIN, 9:8 LBI_RESPONSE, 5 HARD_LIMIT_EN, 0 EN.
+_DAP_AVC_CTRL = const(0x0124)
+
+_DAP_AVC_THRESHOLD = const(0x0126)
+_DAP_AVC_ATTACK = const(0x0128)
+_DAP_AVC_DECAY = const(0x012A)
+
+_DAP_COEF_WR_B1_MSB = const(0x012C)
+_DAP_COEF_WR_B1_LSB = const(0x012E)
+_DAP_COEF_WR_B2_MSB = const(0x0130)
+_DAP_COEF_WR_B2_LSB = const(0x0132)
+_DAP_COEF_WR_A1_MSB = const(0x0134)
+_DAP_COEF_WR_A1_LSB = const(0x0136)
+_DAP_COEF_WR_A2_MSB = const(0x0138)
+_DAP_COEF_WR_A2_LSB = const(0x013A)
+
+
+def _scale_eq(level):
+    # map a -1.0..1.0 EQ gain to the register's 0..95 code, clamped to
+    # the -11.75 dB..+12 dB range the hardware accepts.  The clamp is a
+    # pair of conditional expressions instead of two separate branches,
+    # which mispredict when a band is being ramped through the limit
+    level = int(level * 48 + 0.499)
+    return (-47 if level < -47 else (48 if level > 48 else level)) + 47
+
+
+def _pack_words(pairs):
+    # pack (register, value) pairs into one contiguous burst payload
+    buf = bytearray(4 * len(pairs))
+    offset = 0
+    for reg, val in pairs:
+        struct.pack_into(">HH", buf, offset, reg, val)
+        offset += 4
+    return bytes(buf)
+
+
+# power-up sequence, straight from the datasheet, evaluated once at
+# import into two burst payloads.  At 400 kHz the per-write
+# START/address/STOP framing dominates boot time, so each group goes to
+# the wire with a single START-STOP pair
+_INIT_SEQ_A = _pack_words(
+    (
+        # ANA_POWER is deliberately written twice:  the first value keeps
+        # the analog blocks down while the regulator, reference and short
+        # detect registers are staged, and only then does 0x40FF power
+        # them up - collapsing to one write risks pops and VAG overshoot.
+        # Both writes ride in the same burst, so the staging costs 4
+        # payload bytes, not an extra transaction
+        (_CHIP_ANA_POWER, 0x4060),  # VDDD externally driven with 1.8V
+        (_CHIP_LINREG_CTRL, 0x006C),  # VDDA & VDDIO both over 3.1V
+        (_CHIP_REF_CTRL, 0x01F2),  # VAG=1.575V, normal ramp, +12.5% bias
+        (_CHIP_LINE_OUT_CTRL, 0x0F22),  # LO_VAGCNTRL=1.65V, 0.54mA
+        (_CHIP_SHORT_CTRL, 0x4446),  # allow up to 125mA
+        (_CHIP_ANA_CTRL, 0x0137),  # enable zero cross detectors
+        (_CHIP_ANA_POWER, 0x40FF),  # power up: lineout, hp, adc, dac
+        (_CHIP_DIG_POWER, 0x0073),  # power up all digital blocks
+    )
+)
+_INIT_SEQ_B = _pack_words(
+    (
+        (_CHIP_LINE_OUT_VOL, 0x1D1D),  # ~1.3V p-p nominal
+        (_CHIP_CLK_CTRL, 0x0004),  # sys_fs=44.1 kHz, MCLK=256*Fs
+        (_CHIP_I2S_CTRL, 0x0130),  # SCLK=32*Fs, 16 bit, I2S slave
+        (_CHIP_SSS_CTRL, 0x0010),  # ADC->I2S, I2S->DAC
+        (_CHIP_ADCDAC_CTRL, 0x0000),  # disable DAC mute
+        (_CHIP_DAC_VOL, 0x3C3C),  # DAC digital gain 0 dB
+        (_CHIP_ANA_HP_CTRL, 0x7F7F),  # headphone volume lowest level
+        (_CHIP_ANA_CTRL, 0x0036),  # unmute; zero cross detectors on
+    )
+)
+
+
+# routing for audio_processor(), indexed by (enable << 1) | pre:  the
+# (CHIP_SSS_CTRL, DAP_CONTROL) values for each of the four states.
+# pre is ignored while the DAP is disabled
+# fixed register payload for the microphone input path, packed once at
+# import:  the ADC routing and the mic bias setting never vary, so
+# input_select() sends them as a single burst write
+_MIC_INPUT_SEQ = _pack_words(
+    (
+        (_CHIP_ANA_ADC_CTRL, 0x0088),
+        (_CHIP_MIC_CTRL, 0x0173),
+    )
+)
+
+# graphic EQ band registers indexed by band number:  one indexed load
+# in set_eq_band() instead of an address multiply per call
+_EQ_BAND_REGS = (
+    _DAP_AUDIO_EQ_BASS_BAND0,
+    _DAP_AUDIO_EQ_BAND1,
+    _DAP_AUDIO_EQ_BAND2,
+    _DAP_AUDIO_EQ_BAND3,
+    _DAP_AUDIO_EQ_TREBLE_BAND4,
+)
+
+_AUDIO_PROC_TBL = (
+    (0x0010, 0x0000),  # disabled
+    (0x0010, 0x0000),  # disabled
+    (0x0070, 0x0001),  # enabled, DAC path
+    (0x0013, 0x0001),  # enabled, pre (post-ADC) path
+)
+
+
+class CODEC:
+    # biquad filter types accepted by calc_biquad()
+    FILTER_LOPASS = const(0)
+    FILTER_HIPASS = const(1)
+    FILTER_BANDPASS = const(2)
+    FILTER_NOTCH = const(3)
+    FILTER_PARAEQ = const(4)
+    FILTER_LOSHELF = const(5)
+    FILTER_HISHELF = const(6)
+
+    # calc_biquad() uses the polynomial _fast_sin/_fast_cos by default:
+    # newlib sin/cos cost 1-2 us each on a Cortex-M.  Set False to fall
+    # back to libm when full precision matters more than speed
+    FAST_TRIG = True
+
+    def __init__(self, address, i2c, sample_rate=44100, start=True):
+        """Initialize the codec and run the power-up sequence.
+
+        Args:
+            address (int): I2C address of the SGTL5000 (0x0A).
+            i2c (Class I2C): I2C interface the codec is wired to.
+            sample_rate (int): sample rate in Hz (32000, 44100,
+                48000 or 96000).  Default 44100.
+            start (bool): run the blocking power-up sequence here.
+                Pass False and await start() instead when running
+                under asyncio.
+        """
+        self.address = address
+        self.i2c = i2c
+        # bind the bus write once:  write_word() then pays a single
+        # instance-attribute load instead of resolving .i2c and then
+        # .writeto_mem on the I2C object for every register write
+        self._writeto_mem = i2c.writeto_mem
+
+        # scratch buffer reused by every write_word() call:  a fresh
+        # value payload per register write would put an allocation (and
+        # eventually a GC pass) on every setter call
+        self._vbuf = bytearray(2)
+        self._rbuf = bytearray(2)
+        # last value written to each register, keyed by register address.
+        # write_word() consults it to skip writes that would not change
+        # the register - repeated same-state calls (an idempotent mute,
+        # a volume the user re-applies) then cost a dict probe instead of
+        # an I2C transaction
+        self._last_written = {}
+
+        # a single mask test replaces the bounded-comparison chain:  any
+        # value outside 0..3 (including the -1 lookup miss) has bits set
+        # outside the mask
+        fs = {32000: 0, 44100: 1, 48000: 2, 96000: 3}.get(sample_rate, -1)
+        if fs & ~3:
+            raise ValueError("invalid sample rate: %s" % sample_rate)
+
+        # shadow copies of every register updated by the runtime setters,
+        # initialized to the values the power-up sequence below writes.
+        # With a shadow a setter is a single write:  a read-modify-write
+        # through read_word() would double the bus traffic, since an I2C
+        # read is itself a two-message repeated-start transaction
+        self.adc_dac_ctrl = 0x0000
+        self.ana_ctrl = 0x0036
+        self.mic_ctrl = 0x0000
+        self.auto_volume_control = 0x0000
+        self.bass_enhance = 0x0000
+        self.dac_vol = 0x3C3C
+
+        self._fs = fs
+
+        # memoized biquad coefficients:  repeated EQ reconfiguration with
+        # the same parameters skips the trig entirely.  Bounded FIFO so
+        # RAM stays predictable
+        self._biquad_cache = {}
+        # cached 2*pi/fs for the last sample rate seen by calc_biquad
+        self._last_fs = 0
+        self._twopi_fs = 0.0
+
+        # coefficient generator dispatch table, indexed by the FILTER_*
+        # constants (a compact 0..6 range)
+        self._bq_table = (
+            self._bq_lopass,
+            self._bq_hipass,
+            self._bq_bandpass,
+            self._bq_notch,
+            self._bq_paraeq,
+            self._bq_loshelf,
+            self._bq_hishelf,
+        )
+
+        if start:
+            self.start_blocking()
+
+    def _configure_before_sleep(self):
+        # the power-up sequence is fixed, so the burst payloads are
+        # prebuilt at import:  each writeto() streams a whole group of
+        # register writes in one transaction
+        self.i2c.writeto(self.address, _INIT_SEQ_A)
+
+    def _configure_after_sleep(self):
+        self.i2c.writeto(self.address, _INIT_SEQ_B)
+        if self._fs != 1:
+            # _INIT_SEQ_B is prebuilt for the 44.1 kHz default:  other
+            # rates re-write the clock control register afterwards
+            self.write_word(_CHIP_CLK_CTRL, self._fs << 2)
+
+    def start_blocking(self):
+        """Run the power-up sequence, blocking through the 400 ms
+        digital-power delay the SGTL5000 requires."""
+        self._configure_before_sleep()
+        sleep_ms(400)
+        self._configure_after_sleep()
+
+    async def start(self):
+        """Run the power-up sequence cooperatively:  the 400 ms
+        digital-power delay is awaited, so other asyncio tasks (SD card
+        mount, network bring-up) run instead of busy-waiting."""
+        import uasyncio as asyncio
+
+        self._configure_before_sleep()
+        await asyncio.sleep_ms(400)
+        self._configure_after_sleep()
+
+    @micropython.native
+    def write_word(self, cmd, data):
+        """Write a 16-bit value to a codec register.
+
+        Args:
+            cmd (int): 16-bit register address.
+            data (int): 16-bit value to write.
+        """
+        # the hottest function in the driver:  emitted as native code,
+        # with the value packed by two direct byte stores instead of a
+        # struct call.  writeto_mem() with a 16-bit register address
+        # frames the register write in the C backend.  (viper would drop
+        # more interpreter overhead still, but viper code cannot pass
+        # the addrsize keyword argument)
+        # skip the transaction when the register already holds this
+        # value.  _DAP_FILTER_COEF_ACCESS is exempt:  writing it triggers
+        # a coefficient load, so an identical value is not a no-op
+        last = self._last_written
+        if last.get(cmd) == data and cmd != _DAP_FILTER_COEF_ACCESS:
+            return
+        last[cmd] = data
+        buf = self._vbuf
+        buf[0] = (data >> 8) & 0xFF
+        buf[1] = data & 0xFF
+        self._writeto_mem(self.address, cmd, buf, addrsize=16)
+
+    def read_word(self, cmd):
+        """Read a 16-bit value from a codec register.
+
+        Args:
+            cmd (int): 16-bit register address.
+        Returns:
+            int: 16-bit register value.
+        """
+        # read into a preallocated buffer and decode with shifts:
+        # readfrom_mem() returned a fresh bytes object per call, so every
+        # read-modify-write cycle through modify_word() allocated on both
+        # legs.  With _vbuf on the write side this makes the full RMW
+        # cycle allocation-free
+        buf = self._rbuf
+        self.i2c.readfrom_mem_into(self.address, cmd, buf, addrsize=16)
+        return (buf[0] << 8) | buf[1]
+
+    def _update(self, reg, shadow, mask, value):
+        """Replace a field of a shadowed register and write it back,
+        without an I2C readback.
+
+        Args:
+            reg (int): 16-bit register address.
+            shadow (str): name of the shadow attribute for reg.
+            mask (int): bit mask of the field to replace.
+            value (int): new value for the field, pre-shifted.
+        """
+        new = (getattr(self, shadow) & ~mask) | value
+        setattr(self, shadow, new)
+        self.write_word(reg, new)
+
+    def bulk_configure(self, pairs):
+        """Write a sequence of (register, value) pairs as one I2C burst
+        transaction - the same batching the power-up sequence uses.
+        Useful when several settings change together (a scene change):
+        one START/STOP pair on the wire instead of one per register.
+
+        Args:
+            pairs: iterable of (register, value) tuples.
+        """
+        self.i2c.writeto(self.address, _pack_words(pairs))
+        # keep the written-value cache coherent with the burst, so a
+        # later write_word of the same value is still skipped (and a
+        # different value is not wrongly skipped)
+        last = self._last_written
+        for reg, value in pairs:
+            last[reg] = value
+
+    def modify_word(self, cmd, data, mask):
+        """Read-modify-write a codec register field.
+
+        Args:
+            cmd (int): 16-bit register address.
+            data (int): new value for the field, pre-shifted.
+            mask (int): bit mask of the field to replace.
+        Returns:
+            int: the value written back to the register.
+        """
+        current = self.read_word(cmd)
+        # refresh the written-value cache from the readback:  the
+        # hardware may have diverged from the last write (self-clearing
+        # bits), and the skip test in write_word must compare against
+        # what the register actually holds
+        self._last_written[cmd] = current
+        value = (current & ~mask) | data
+        self.write_word(cmd, value)
+        return value
+
+    def mute_dac(self, mute=True):
+        """Mute or unmute the DAC (both channels)."""
+        self._update(_CHIP_ADCDAC_CTRL, "adc_dac_ctrl", 0x000C, 0x000C if mute else 0x0000)
+
+    def mute_headphone(self, mute=True):
+        """Mute or unmute the headphone output."""
+        self._update(_CHIP_ANA_CTRL, "ana_ctrl", 0x0010, 0x0010 if mute else 0x0000)
+
+    def mute_lineout(self, mute=True):
+        """Mute or unmute the line output."""
+        self._update(_CHIP_ANA_CTRL, "ana_ctrl", 0x0100, 0x0100 if mute else 0x0000)
+
+    def headphone_select(self, select):
+        """Select the headphone source.
+
+        Args:
+            select (int): 0=DAC, 1=LINEIN bypass.
+        """
+        if select not in (0, 1):
+            raise ValueError("invalid headphone source")
+        self._update(_CHIP_ANA_CTRL, "ana_ctrl", 0x0040, select << 6)
+
+    def input_select(self, select):
+        """Select the ADC input.
+
+        Args:
+            select (int): 0=LINEIN, 1=microphone.
+        """
+        if select == 0:
+            # +7.5 dB analog gain to compensate the line level
+            self.write_word(_CHIP_ANA_ADC_CTRL, 0x0055)
+            self._update(_CHIP_ANA_CTRL, "ana_ctrl", 0x0004, 0x0004)
+        elif select == 1:
+            # ADC routing and microphone bias (3.0V through 2.0 kohm)
+            # are fixed for this path:  send the payload packed at
+            # import as one burst, then keep the shadow and the
+            # written-value cache coherent with what went on the wire
+            self.i2c.writeto(self.address, _MIC_INPUT_SEQ)
+            self.mic_ctrl = 0x0173
+            self._last_written[_CHIP_ANA_ADC_CTRL] = 0x0088
+            self._last_written[_CHIP_MIC_CTRL] = 0x0173
+            self._update(_CHIP_ANA_CTRL, "ana_ctrl", 0x0004, 0x0000)
+        else:
+            raise ValueError("invalid ADC input")
+
+    def mic_gain(self, gain):
+        """Set the microphone preamp gain.
+
+        Args:
+            gain (int): gain in dB (0, 20, 30 or 40).
+        """
+        gains = {0: 0, 20: 1, 30: 2, 40: 3}
+        if gain not in gains:
+            raise ValueError("invalid mic gain")
+        self._update(_CHIP_MIC_CTRL, "mic_ctrl", 0x0003, gains[gain])
+
+    def calc_volume(self, volume, range):
+        """Scale a 0.0 - 1.0 volume to an integer register field.
+
+        Args:
+            volume (float): volume, 0.0 (off) to 1.0 (maximum).
+            range (int): full-scale value of the register field.
+        Returns:
+            int: the scaled field value.
+        """
+        # kept for API compatibility;  the hot callers inline this
+        # expression to save the call frame
+        return min(range, int(volume * range + 0.499))
+
+    def dac_volume(self, left, right):
+        """Set the DAC digital volume.
+
+        Args:
+            left (float): left channel volume, 0.0 to 1.0.
+            right (float): right channel volume, 0.0 to 1.0.
+        """
+        # scaling inlined from calc_volume:  a Python call frame costs
+        # about a microsecond on these ports, and volume ramps hit this
+        # method repeatedly
+        left_vol = 0xFC - min(0xC0, int(left * 0xC0 + 0.499))
+        right_vol = 0xFC - min(0xC0, int(right * 0xC0 + 0.499))
+        self.dac_vol = (right_vol << 8) | left_vol
+        self.write_word(_CHIP_DAC_VOL, self.dac_vol)
+
+    def dac_volume_ramp(self, enable=True, linear=False):
+        """Enable or disable the DAC volume ramp.
+
+        Args:
+            enable (bool): ramp volume changes instead of stepping.
+            linear (bool): linear ramp instead of exponential.
+        """
+        if enable:
+            value = 0x0300 if linear else 0x0200
+        else:
+            value = 0x0000
+        self._update(_CHIP_ADCDAC_CTRL, "adc_dac_ctrl", 0x0300, value)
+
+    def volume(self, left, right):
+        """Set the headphone volume.
+
+        Args:
+            left (float): left channel volume, 0.0 to 1.0.
+            right (float): right channel volume, 0.0 to 1.0.
+        """
+        # scaling inlined from calc_volume (see dac_volume)
+        left_vol = 0x7F - min(0x7F, int(left * 0x7F + 0.499))
+        right_vol = 0x7F - min(0x7F, int(right * 0x7F + 0.499))
+        self.write_word(_CHIP_ANA_HP_CTRL, (right_vol << 8) | left_vol)
+
+    def adc_high_pass_filter(self, enable=True, freeze=False):
+        """Control the ADC high-pass filter.
+
+        Args:
+            enable (bool): enable the DC blocking filter.
+            freeze (bool): freeze the filter offset at its current value.
+        """
+        if not enable:
+            self._update(_CHIP_ADCDAC_CTRL, "adc_dac_ctrl", 0x0001, 0x0001)
+        elif freeze:
+            self._update(_CHIP_ADCDAC_CTRL, "adc_dac_ctrl", 0x0003, 0x0002)
+        else:
+            self._update(_CHIP_ADCDAC_CTRL, "adc_dac_ctrl", 0x0003, 0x0000)
+
+    def audio_processor(self, enable=True, pre=True):
+        """Route the digital audio processor into the DAC path.
+
+        Args:
+            enable (bool): enable the DAP.
+            pre (bool): process before the I2S output (post-ADC)
+                instead of the DAC input path.
+        """
+        # bind the bound method once:  LOAD_FAST per call below instead
+        # of a LOAD_ATTR lookup
+        ww = self.write_word
+        sss, dap = _AUDIO_PROC_TBL[(int(enable) << 1) | int(pre)]
+        ww(_CHIP_SSS_CTRL, sss)
+        ww(_DAP_CONTROL, dap)
+
+    def auto_volume_configure(self, max_gain, lbi_response, hard_limit, threshold, attack, decay):
+        """Configure the automatic volume control.
+
+        Args:
+            max_gain (int): maximum gain, 0=0dB, 1=6dB, 2=12dB.
+            lbi_response (int): integrator response, 0=0ms, 1=25ms,
+                2=50ms, 3=100ms.
+            hard_limit (int): 0=soft knee, 1=hard limit at threshold.
+            threshold (float): threshold in dB (negative).
+            attack (float): gain ramp-down rate, dB/s.
+            decay (float): gain ramp-up rate, dB/s.
+        """
+        if max_gain & ~3 or max_gain == 3:
+            raise ValueError("invalid max_gain")
+        if lbi_response & ~3:
+            raise ValueError("invalid lbi_response")
+        if hard_limit & ~1:
+            raise ValueError("invalid hard_limit")
+        # the 2**15 / 2**19 / 2**23 quantization factors are written as
+        # literals:  pow(2, k) went through the float pow() path on
+        # every call just to produce a constant
+        thresh = int(exp(threshold * _LN10_OVER_20) * 0.636 * 32768.0)
+        att = int((1 - exp(-attack * _LN10_OVER_20FS)) * 524288.0)
+        dec = int((1 - exp(-decay * _LN10_OVER_20FS)) * 8388608.0)
+        self.auto_volume_control = (
+            (max_gain << 12) | (lbi_response << 8) | (hard_limit << 5)
+            | (self.auto_volume_control & 0x0001)
+        )
+        ww = self.write_word
+        ww(_DAP_AVC_THRESHOLD, thresh)
+        ww(_DAP_AVC_ATTACK, att)
+        ww(_DAP_AVC_DECAY, dec)
+        ww(_DAP_AVC_CTRL, self.auto_volume_control)
+
+    def auto_volume_enable(self, enable=True):
+        """Enable or disable the automatic volume control."""
+        self._update(_DAP_AVC_CTRL, "auto_volume_control", 0x0001, int(enable))
+
+    def bass_enhance_configure(self, lr_level, bass_level, bypass_hpf=False, cutoff=4):
+        """Configure the bass enhancement block.
+
+        Args:
+            lr_level (float): dry signal level, 0.0 to 1.0.
+            bass_level (float): harmonics level, 0.0 to 1.0.
+            bypass_hpf (bool): bypass the enhancement high-pass filter.
+            cutoff (int): cutoff frequency select, 0=80Hz .. 6=225Hz.
+        """
+        if cutoff & ~7 or cutoff == 7:
+            raise ValueError("invalid cutoff")
+        # scaling inlined from calc_volume (see dac_volume)
+        lr = 0x3F - min(0x3F, int(lr_level * 0x3F + 0.499))
+        bass = 0x7F - min(0x7F, int(bass_level * 0x7F + 0.499))
+        self.write_word(_DAP_BASS_ENHANCE_CTRL, (lr << 8) | bass)
+        # mask-clear the bypass and cutoff fields before merging the
+        # new values:  OR-ing cumulatively left stale cutoff bits set
+        # after a reconfigure with a lower cutoff.  The write-skip cache
+        # in write_word then drops the transaction entirely when the
+        # resulting value is unchanged
+        self.bass_enhance = (
+            (self.bass_enhance & ~0x01F0) | (int(bypass_hpf) << 8) | (cutoff << 4)
+        )
+        self.write_word(_DAP_BASS_ENHANCE, self.bass_enhance)
+
+    def bass_enhance_enable(self, enable=True):
+        """Enable or disable the bass enhancement block."""
+        self._update(_DAP_BASS_ENHANCE, "bass_enhance", 0x0001, int(enable))
+
+    def surround_sound(self, width=4, select=3):
+        """Configure the virtual surround block.
+
+        Args:
+            width (int): perceived width, 0 (narrow) to 7 (wide).
+            select (int): 0=disabled, 2=mono input, 3=stereo input.
+        """
+        if width & ~7:
+            raise ValueError("invalid width")
+        if select not in (0, 2, 3):
+            raise ValueError("invalid select")
+        self.write_word(_DAP_SGTL_SURROUND, (width << 4) | select)
+
+    def eq_select(self, eq):
+        """Select the EQ type.
+
+        Args:
+            eq (int): 0=disabled, 1=parametric EQ, 2=tone control,
+                3=5-band graphic EQ.
+        """
+        if eq & ~3:
+            raise ValueError("invalid eq")
+        self.write_word(_DAP_AUDIO_EQ, eq)
+
+    def set_eq_band(self, band, level):
+        """Set one graphic EQ band.
+
+        Args:
+            band (int): band index 0-4 (115 Hz, 330 Hz, 990 Hz,
+                3 kHz, 9.9 kHz).
+            level (float): gain, -1.0 (-11.75 dB) to 1.0 (+12 dB).
+        """
+        self.write_word(_EQ_BAND_REGS[band], _scale_eq(level))
+
+    def set_eq_bands(self, bass, mid_bass, midrange, mid_treble, treble):
+        """Set all five graphic EQ bands, each -1.0 to 1.0."""
+        # write the band registers directly instead of five set_eq_band()
+        # calls:  each call redid the method lookup and the band-to-
+        # register arithmetic.  The scaling lives in the shared module
+        # helper, so it is written (and validated) in exactly one place
+        ww = self.write_word
+        for reg, level in (
+            (_DAP_AUDIO_EQ_BASS_BAND0, bass),
+            (_DAP_AUDIO_EQ_BAND1, mid_bass),
+            (_DAP_AUDIO_EQ_BAND2, midrange),
+            (_DAP_AUDIO_EQ_BAND3, mid_treble),
+            (_DAP_AUDIO_EQ_TREBLE_BAND4, treble),
+        ):
+            ww(reg, _scale_eq(level))
+
+    def set_eq_filter(self, filter_num, filter_parameters):
+        """Load one parametric EQ biquad filter.
+
+        Args:
+            filter_num (int): filter index, 0-6.
+            filter_parameters: 5 coefficients from calc_biquad().
+        """
+        # load all ten coefficient halves and the commit trigger in one
+        # I2C burst:  eleven write_word() calls were eleven START/STOP
+        # framed transactions, and the per-transaction overhead dominates
+        # on a 100 kHz bus.  The coefficient registers are not contiguous
+        # (B0 sits at 0x010E/0x0110, B1 onward at 0x012C..), so each pair
+        # still carries its register address - but the bus sees a single
+        # transaction either way
+        b0, b1, b2, a1, a2 = filter_parameters
+        self.bulk_configure(
+            (
+                (_DAP_COEF_WR_B0_MSB, (b0 >> 4) & 0xFFFF),
+                (_DAP_COEF_WR_B0_LSB, b0 & 0x000F),
+                (_DAP_COEF_WR_B1_MSB, (b1 >> 4) & 0xFFFF),
+                (_DAP_COEF_WR_B1_LSB, b1 & 0x000F),
+                (_DAP_COEF_WR_B2_MSB, (b2 >> 4) & 0xFFFF),
+                (_DAP_COEF_WR_B2_LSB, b2 & 0x000F),
+                (_DAP_COEF_WR_A1_MSB, (a1 >> 4) & 0xFFFF),
+                (_DAP_COEF_WR_A1_LSB, a1 & 0x000F),
+                (_DAP_COEF_WR_A2_MSB, (a2 >> 4) & 0xFFFF),
+                (_DAP_COEF_WR_A2_LSB, a2 & 0x000F),
+                (_DAP_FILTER_COEF_ACCESS, 0x0100 | filter_num),
+            )
+        )
+
+    # per-filter-type biquad coefficient generators, dispatched through
+    # _bq_table by calc_biquad():  one indexed load replaces an average
+    # of four state comparisons per call.  The generators and
+    # calc_biquad are emitted as native code - pure float arithmetic is
+    # where the bytecode dispatch loop hurts most, and native keeps full
+    # float support where viper would not.  Subexpressions shared within
+    # a generator are hoisted into locals - every repeated
+    # (a +/- 1) * cosw or beta * sinw was a fresh float computation
+    # (and allocation) in the interpreter
+
+    @micropython.native
+    def _bq_lopass(self, cosw, sinw, alpha, a, beta):
+        one_minus_cosw = 1.0 - cosw
+        b0 = one_minus_cosw * 0.5
+        return (b0, one_minus_cosw, b0, 1.0 + alpha, 2.0 * cosw, alpha - 1.0)
+
+    @micropython.native
+    def _bq_hipass(self, cosw, sinw, alpha, a, beta):
+        one_plus_cosw = 1.0 + cosw
+        b0 = one_plus_cosw * 0.5
+        return (b0, -one_plus_cosw, b0, 1.0 + alpha, 2.0 * cosw, alpha - 1.0)
+
+    @micropython.native
+    def _bq_bandpass(self, cosw, sinw, alpha, a, beta):
+        return (alpha, 0.0, -alpha, 1.0 + alpha, 2.0 * cosw, alpha - 1.0)
+
+    @micropython.native
+    def _bq_notch(self, cosw, sinw, alpha, a, beta):
+        cosw2 = 2.0 * cosw
+        return (1.0, -cosw2, 1.0, 1.0 + alpha, cosw2, alpha - 1.0)
+
+    @micropython.native
+    def _bq_paraeq(self, cosw, sinw, alpha, a, beta):
+        alpha_a = alpha * a
+        alpha_over_a = alpha / a
+        cosw2 = 2.0 * cosw
+        return (
+            1.0 + alpha_a,
+            -cosw2,
+            1.0 - alpha_a,
+            1.0 + alpha_over_a,
+            cosw2,
+            alpha_over_a - 1.0,
+        )
+
+    @micropython.native
+    def _bq_loshelf(self, cosw, sinw, alpha, a, beta):
+        ap1 = a + 1.0
+        am1 = a - 1.0
+        apc = ap1 * cosw
+        amc = am1 * cosw
+        bs = beta * sinw
+        return (
+            a * (ap1 - amc + bs),
+            2.0 * a * (am1 - apc),
+            a * (ap1 - amc - bs),
+            ap1 + amc + bs,
+            2.0 * (am1 + apc),
+            -(ap1 + amc - bs),
+        )
+
+    @micropython.native
+    def _bq_hishelf(self, cosw, sinw, alpha, a, beta):
+        ap1 = a + 1.0
+        am1 = a - 1.0
+        apc = ap1 * cosw
+        amc = am1 * cosw
+        bs = beta * sinw
+        return (
+            a * (ap1 + amc + bs),
+            -2.0 * a * (am1 + apc),
+            a * (ap1 + amc - bs),
+            ap1 - amc + bs,
+            -2.0 * (am1 - apc),
+            -(ap1 - amc - bs),
+        )
+
+    @micropython.native
+    def calc_biquad(
+        self,
+        filter_type,
+        fc,
+        db_gain,
+        q,
+        quantization_unit,
+        fs,
+        # the trailing defaults bind the math functions as locals:
+        # MicroPython resolves a global through the module dict on
+        # every reference, while a default argument is a LOAD_FAST
+        exp=exp,
+        sqrt=sqrt,
+        cos=cos,
+        sin=sin,
+        _fast_cos=_fast_cos,
+        _fast_sin=_fast_sin,
+    ):
+        """Compute quantized biquad coefficients for the parametric EQ.
+
+        Args:
+            filter_type (int): one of the FILTER_* constants.
+            fc (float): center/corner frequency in Hz.
+            db_gain (float): gain in dB (shelf and peaking filters).
+            q (float): filter Q.
+            quantization_unit (int): coefficient quantization, 524288
+                for the SGTL5000.
+            fs (int): sample rate in Hz.
+        Returns:
+            tuple: 5 quantized coefficients for set_eq_filter().
+        """
+        key = (filter_type, fc, db_gain, q, quantization_unit, fs)
+        cached = self._biquad_cache.get(key)
+        if cached is not None:
+            return cached
+        if filter_type & ~7 or filter_type == 7:
+            raise ValueError("invalid filter type")
+        # flat-gain fast path:  at db_gain 0 the dB-to-linear factor is
+        # exactly 1.0, and the four plain filter types (lowpass through
+        # notch) never read a at all - both cases skip the exp, the
+        # costliest operation left in this function
+        if db_gain == 0.0 or filter_type < self.FILTER_PARAEQ:
+            a = 1.0
+        elif filter_type == self.FILTER_PARAEQ:
+            a = exp(db_gain * _K40)
+        else:
+            a = exp(db_gain * _K20)
+        # 2*pi/fs is invariant while the sample rate is - and fs is the
+        # codec rate on essentially every call - so cache it and reduce
+        # the angle computation to a single multiply
+        if fs != self._last_fs:
+            self._last_fs = fs
+            self._twopi_fs = 2.0 * pi / fs
+        w0 = self._twopi_fs * fc
+        if self.FAST_TRIG:
+            cosw = _fast_cos(w0)
+            sinw = _fast_sin(w0)
+        else:
+            cosw = cos(w0)
+            sinw = sin(w0)
+        alpha = sinw / (2 * q)
+        # only the two shelf generators use beta:  skip the sqrt (one of
+        # the slowest libm calls) for the other five filter types, and
+        # for a flat-gain shelf where sqrt(1.0) is known
+        if filter_type < self.FILTER_LOSHELF:
+            beta = 0.0
+        elif a == 1.0:
+            beta = 1.0 / q
+        else:
+            beta = sqrt(a) / q
+        b0, b1, b2, a0, a1, a2 = self._bq_table[filter_type](cosw, sinw, alpha, a, beta)
+        # normalize with one divide and five multiplies:  float divide
+        # is an order of magnitude slower than multiply on Cortex-M
+        # parts without hardware divide.  A tuple literal is the
+        # cheapest 5-element container to build, and the result is
+        # read-only anyway - set_eq_filter only unpacks it, and the
+        # cache must not hand out something a caller could mutate
+        inv = quantization_unit / (a0 * 2)
+        coef = (
+            int(b0 * inv + 0.499),
+            int(b1 * inv + 0.499),
+            int(b2 * inv + 0.499),
+            int(a1 * inv + 0.499),
+            int(a2 * inv + 0.499),
+        )
+        if len(self._biquad_cache) >= 16:
+            # evict the oldest entry (dicts iterate in insertion order)
+            del self._biquad_cache[next(iter(self._biquad_cache))]
+        self._biquad_cache[key] = coef
+        return coef